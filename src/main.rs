@@ -2,116 +2,197 @@ mod intrinsics;
 
 use std::env;
 use std::fs;
+use std::fmt::Write as _;
+use std::io::{self, Write};
 use std::path::PathBuf;
 use std::process;
+use std::borrow::Cow;
 use std::collections::{HashMap, HashSet};
 
 #[derive(Debug, Clone, PartialEq)]
-pub enum IRNode {
-    Atom(String),
-    List(Vec<IRNode>),
+pub enum IRNode<'a> {
+    Atom(Cow<'a, str>),
+    List(Vec<IRNode<'a>>),
 }
 
-impl IRNode {
+impl<'a> IRNode<'a> {
     pub fn is_list(&self) -> bool { matches!(self, IRNode::List(_)) }
-    pub fn as_list(&self) -> Option<&Vec<IRNode>> {
+    pub fn as_list(&self) -> Option<&Vec<IRNode<'a>>> {
         match self { IRNode::List(l) => Some(l), _ => None }
     }
-    pub fn as_atom(&self) -> Option<&String> {
+    pub fn as_atom(&self) -> Option<&str> {
         match self { IRNode::Atom(s) => Some(s), _ => None }
     }
-    pub fn to_ir(&self) -> String {
+    pub fn write_ir<W: Write>(&self, out: &mut W) -> io::Result<()> {
         match self {
             IRNode::Atom(s) => {
-                if s.contains(' ') || s.is_empty() || s.contains('\n') || s.contains('\"') {
-                    format!("\"{}\"", s.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t"))
+                if s.is_empty() || s.bytes().any(|b| matches!(b, b' ' | b'\n' | b'\r' | b'\t' | b'"' | b'(' | b')')) {
+                    out.write_all(b"\"")?;
+                    let mut start = 0;
+                    for (i, b) in s.bytes().enumerate() {
+                        let esc: &[u8] = match b {
+                            b'\\' => b"\\\\",
+                            b'"' => b"\\\"",
+                            b'\n' => b"\\n",
+                            b'\r' => b"\\r",
+                            b'\t' => b"\\t",
+                            _ => continue,
+                        };
+                        out.write_all(s[start..i].as_bytes())?;
+                        out.write_all(esc)?;
+                        start = i + 1;
+                    }
+                    out.write_all(s[start..].as_bytes())?;
+                    out.write_all(b"\"")
                 } else {
-                    s.clone()
+                    out.write_all(s.as_bytes())
                 }
             }
             IRNode::List(l) => {
-                let mut res = String::from("(");
+                out.write_all(b"(")?;
                 for (i, item) in l.iter().enumerate() {
-                    if i > 0 { res.push(' '); }
-                    res.push_str(&item.to_ir());
+                    if i > 0 { out.write_all(b" ")?; }
+                    item.write_ir(out)?;
                 }
-                res.push(')');
-                res
+                out.write_all(b")")
             }
         }
     }
 }
 
-pub struct IRParser {
-    tokens: Vec<String>,
+// Atoms borrow from the input rather than copying it, so the IR text must outlive the tree.
+pub struct IRParser<'a> {
+    input: &'a str,
     pos: usize,
 }
 
-impl IRParser {
-    pub fn new(input: &str) -> Self {
-        let mut tokens = Vec::new();
-        let mut chars = input.chars().peekable();
-        while let Some(&c) = chars.peek() {
-            if c.is_whitespace() { chars.next(); }
-            else if c == '(' || c == ')' { tokens.push(c.to_string()); chars.next(); }
-            else if c == '"' {
-                chars.next();
-                let mut s = String::new();
-                while let Some(nc) = chars.next() {
-                    if nc == '"' { break; }
-                    if nc == '\\' {
-                        if let Some(esc) = chars.next() {
-                            s.push(match esc {
-                                'n' => '\n', 'r' => '\r', 't' => '\t', _ => esc,
-                            });
-                        }
-                    } else { s.push(nc); }
-                }
-                tokens.push(format!("\"{}\"", s));
-            } else {
-                let mut s = String::new();
-                while let Some(&nc) = chars.peek() {
-                    if nc.is_whitespace() || nc == '(' || nc == ')' { break; }
-                    s.push(chars.next().unwrap());
-                }
-                tokens.push(s);
+impl<'a> IRParser<'a> {
+    pub fn new(input: &'a str) -> Self {
+        Self { input, pos: 0 }
+    }
+
+    // Reads a quoted atom whose opening quote has been consumed, resolving escapes.
+    // Only strings that contain an escape need an owned copy.
+    fn read_string(&mut self) -> Cow<'a, str> {
+        let (input, bytes) = (self.input, self.input.as_bytes());
+        let mut i = self.pos;
+        let n = bytes[i..].iter().position(|&b| b == b'"' || b == b'\\').unwrap_or(bytes.len() - i);
+        if bytes.get(i + n) != Some(&b'\\') {
+            self.pos = i + n + 1;
+            return Cow::Borrowed(&input[i..i + n]);
+        }
+        let mut s = String::new();
+        let mut start = i;
+        i += n;
+        while i < bytes.len() && bytes[i] != b'"' {
+            if bytes[i] != b'\\' { i += 1; continue; }
+            s.push_str(&input[start..i]);
+            i += 1;
+            if let Some(esc) = input[i..].chars().next() {
+                s.push(match esc {
+                    'n' => '\n', 'r' => '\r', 't' => '\t', _ => esc,
+                });
+                i += esc.len_utf8();
             }
+            start = i;
         }
-        Self { tokens, pos: 0 }
+        s.push_str(&input[start..i]);
+        self.pos = i + 1;
+        Cow::Owned(s)
     }
 
-    pub fn parse(&mut self) -> Option<IRNode> {
-        if self.pos >= self.tokens.len() { return None; }
-        let token = &self.tokens[self.pos];
-        self.pos += 1;
-        if token == "(" {
-            let mut list = Vec::new();
-            while self.pos < self.tokens.len() && self.tokens[self.pos] != ")" {
-                if let Some(node) = self.parse() { list.push(node); }
+    pub fn parse(&mut self) -> Option<IRNode<'a>> {
+        // Nodes are built as the input is scanned, with no intermediate token list.
+        // Open lists live on an explicit stack, so parsing does not recurse. Writing, lowering and
+        // dropping the tree still recurse once per level of nesting.
+        let (input, bytes) = (self.input, self.input.as_bytes());
+        let mut stack: Vec<Vec<IRNode<'a>>> = Vec::new();
+        while self.pos < bytes.len() {
+            let i = self.pos;
+            let c = bytes[i];
+            let node = if c.is_ascii_whitespace() {
+                self.pos += bytes[i..].iter().position(|b| !b.is_ascii_whitespace()).unwrap_or(bytes.len() - i);
+                continue;
+            } else if c == b'(' {
+                self.pos += 1;
+                stack.push(Vec::new());
+                continue;
+            } else if c == b')' && !stack.is_empty() {
+                self.pos += 1;
+                IRNode::List(stack.pop().unwrap())
+            } else if c == b'"' {
+                self.pos += 1;
+                IRNode::Atom(self.read_string())
+            } else {
+                // A ')' with no open list is kept as an atom of its own.
+                let len = if c == b')' { 1 } else {
+                    bytes[i..].iter().position(|&b| BYTE_CLASS[b as usize] & IR_DELIM != 0).unwrap_or(bytes.len() - i)
+                };
+                self.pos += len;
+                IRNode::Atom(Cow::Borrowed(&input[i..i + len]))
+            };
+            match stack.last_mut() {
+                Some(list) => list.push(node),
+                None => return Some(node),
+            }
+        }
+        // Unterminated lists are closed at end of input.
+        while let Some(list) = stack.pop() {
+            let node = IRNode::List(list);
+            match stack.last_mut() {
+                Some(parent) => parent.push(node),
+                None => return Some(node),
             }
-            if self.pos < self.tokens.len() { self.pos += 1; }
-            Some(IRNode::List(list))
-        } else if token.starts_with('"') && token.ends_with('"') {
-            Some(IRNode::Atom(token[1..token.len()-1].to_string()))
-        } else {
-            Some(IRNode::Atom(token.clone()))
         }
+        None
     }
 }
 
-#[derive(Debug, Clone, PartialEq)]
+#[derive(Debug, Clone, Copy, PartialEq)]
 enum TokenKind { Ident, Num, Str, Sym, Eof }
 
 #[derive(Debug, Clone)]
 struct Token {
     kind: TokenKind,
-    value: String,
+    value: Cow<'static, str>,
+    // Numeric suffix and its IR tag, recorded by the lexer so the parser need not rescan the literal.
+    suffix: Option<(&'static str, &'static str)>,
     line: usize,
     col: usize,
 }
 
+// Keywords and punctuation share static text instead of allocating a String per token.
+const KEYWORDS: [&str; 11] = ["fn", "let", "return", "if", "else", "while", "struct", "import", "returns", "true", "false"];
+const SYMBOLS: &str = "(){}[]<>=!+-*/%&|^~,;:.";
+// Byte classes for the ASCII scans: identifier continuation and decimal number bodies in the lexer,
+// and the whitespace and parentheses that end an atom in the IR tokenizer.
+const IDENT_BYTE: u8 = 1;
+const NUM_BYTE: u8 = 2;
+const IR_DELIM: u8 = 4;
+const BYTE_CLASS: [u8; 256] = {
+    let mut table = [0u8; 256];
+    let mut i = 0;
+    while i < 256 {
+        let b = i as u8;
+        if b.is_ascii_alphanumeric() || b == b'_' { table[i] |= IDENT_BYTE; }
+        if b.is_ascii_digit() || b == b'.' { table[i] |= NUM_BYTE; }
+        if b.is_ascii_whitespace() || b == b'(' || b == b')' { table[i] |= IR_DELIM; }
+        i += 1;
+    }
+    table
+};
+// Numeric literal suffixes and the IR tag each one lowers to.
+const NUM_SUFFIXES: [(&str, &str); 4] = [("i64", "int_i64"), ("i32", "int"), ("f64", "f64"), ("f32", "f32")];
+// Binary operator token, precedence (higher binds tighter) and IR op name.
+const CMP_PREC: u8 = 3;
+const BINARY_OPS: [(&str, u8, &str); 14] = [
+    ("||", 1, "or"), ("|", 1, "or"), ("&&", 2, "and"), ("&", 2, "and"),
+    ("==", CMP_PREC, "eq"), ("!=", CMP_PREC, "ne"), ("<", CMP_PREC, "lt"), (">", CMP_PREC, "gt"), ("<=", CMP_PREC, "le"), (">=", CMP_PREC, "ge"),
+    ("+", 4, "add"), ("-", 4, "sub"), ("*", 5, "mul"), ("/", 5, "div"),
+];
+
 struct Lexer {
-    source: Vec<char>,
+    source: String,
     pos: usize,
     line: usize,
     col: usize,
@@ -119,97 +200,134 @@ struct Lexer {
 
 impl Lexer {
     fn new(source: String) -> Self {
-        Self { source: source.chars().collect(), pos: 0, line: 1, col: 1 }
+        Self { source, pos: 0, line: 1, col: 1 }
     }
     fn peek(&self, n: usize) -> Option<char> {
-        if self.pos + n < self.source.len() { Some(self.source[self.pos + n]) } else { None }
+        // Source is almost always ASCII; only decode UTF-8 when a multi-byte char is in the window.
+        match self.source.as_bytes()[self.pos..].get(..=n) {
+            Some(bs) if bs.is_ascii() => Some(bs[n] as char),
+            _ => self.source[self.pos..].chars().nth(n),
+        }
     }
     fn advance(&mut self) -> Option<char> {
         let c = self.peek(0)?;
-        self.pos += 1;
+        self.pos += c.len_utf8();
         if c == '\n' { self.line += 1; self.col = 1; } else { self.col += 1; }
         Some(c)
     }
+    // Advance over the next `n` bytes in one step, keeping line/col in sync.
+    fn advance_by(&mut self, n: usize) {
+        let run = &self.source[self.pos..self.pos + n];
+        match run.rfind('\n') {
+            Some(last) => {
+                self.line += run.matches('\n').count();
+                self.col = run[last + 1..].chars().count() + 1;
+            }
+            None => self.col += run.chars().count(),
+        }
+        self.pos += n;
+    }
+    // Advance while `pred` holds and return the start of the scanned run.
+    fn scan_while(&mut self, pred: impl Fn(char) -> bool) -> usize {
+        let start = self.pos;
+        let rest = &self.source[start..];
+        let n = rest.find(|c: char| !pred(c)).unwrap_or(rest.len());
+        self.advance_by(n);
+        start
+    }
+    // Byte-level scan_while; `pred` must only stop on ASCII bytes so the run ends on a char boundary.
+    fn scan_bytes(&mut self, pred: impl Fn(u8) -> bool) -> usize {
+        let start = self.pos;
+        let rest = &self.source.as_bytes()[start..];
+        let n = rest.iter().position(|&b| !pred(b)).unwrap_or(rest.len());
+        self.advance_by(n);
+        start
+    }
+    fn skip_whitespace(&mut self) {
+        let rest = &self.source.as_bytes()[self.pos..];
+        let n = rest.iter().position(|b| !b.is_ascii_whitespace()).unwrap_or(rest.len());
+        if n == 0 { self.advance(); } else { self.advance_by(n); }
+    }
     fn tokenize(&mut self) -> Vec<Token> {
-        let mut tokens = Vec::new();
+        // Sources average three to four bytes per token; sizing for four avoids most regrowth.
+        let mut tokens = Vec::with_capacity(self.source.len() / 4 + 1);
         while self.pos < self.source.len() {
             let c = self.peek(0).unwrap();
-            if c.is_whitespace() { self.advance(); }
+            if c.is_whitespace() { self.skip_whitespace(); }
             else if c == '/' && self.peek(1) == Some('/') {
-                while self.peek(0).is_some() && self.peek(0) != Some('\n') { self.advance(); }
+                self.scan_bytes(|b| b != b'\n');
             } else if c.is_alphabetic() || c == '_' {
                 let (sl, sc) = (self.line, self.col);
-                let mut val = String::new();
-                while let Some(nc) = self.peek(0) {
-                    if nc.is_alphanumeric() || nc == '_' { val.push(self.advance().unwrap()); } else { break; }
+                let start = self.scan_bytes(|b| BYTE_CLASS[b as usize] & IDENT_BYTE != 0);
+                if self.source.as_bytes().get(self.pos).is_some_and(|b| !b.is_ascii()) {
+                    self.scan_while(|c| c.is_alphanumeric() || c == '_');
                 }
-                tokens.push(Token { kind: TokenKind::Ident, value: val, line: sl, col: sc });
+                let text = &self.source[start..self.pos];
+                let value = match KEYWORDS.iter().find(|k| **k == text) {
+                    Some(k) => Cow::Borrowed(*k),
+                    None => Cow::Owned(text.to_string()),
+                };
+                tokens.push(Token { kind: TokenKind::Ident, value, suffix: None, line: sl, col: sc });
             } else if c.is_digit(10) {
-                let (sl, sc) = (self.line, self.col);
-                let mut val = String::new();
+                let (sl, sc, start) = (self.line, self.col, self.pos);
                 if c == '0' && self.peek(1) == Some('x') {
-                    val.push(self.advance().unwrap()); val.push(self.advance().unwrap());
-                    while let Some(nc) = self.peek(0) {
-                        if nc.is_digit(16) { val.push(self.advance().unwrap()); } else { break; }
-                    }
+                    self.advance_by(2);
+                    self.scan_bytes(|b| b.is_ascii_hexdigit());
                 } else {
-                    while let Some(nc) = self.peek(0) {
-                        if nc.is_digit(10) || nc == '.' { val.push(self.advance().unwrap()); } else { break; }
-                    }
+                    self.scan_bytes(|b| BYTE_CLASS[b as usize] & NUM_BYTE != 0);
                 }
-                for suf in ["i64", "i32", "f64", "f32"] {
-                    let mut match_suf = true;
-                    for (j, sc) in suf.chars().enumerate() {
-                        if self.peek(j) != Some(sc) { match_suf = false; break; }
-                    }
-                    if match_suf {
-                        val.push_str(suf);
-                        for _ in 0..suf.len() { self.advance(); }
-                        break;
-                    }
+                let suffix = NUM_SUFFIXES.iter().find(|(suf, _)| self.source[self.pos..].starts_with(suf)).copied();
+                if let Some((suf, _)) = suffix {
+                    self.pos += suf.len(); self.col += suf.len();
                 }
-                tokens.push(Token { kind: TokenKind::Num, value: val, line: sl, col: sc });
+                tokens.push(Token { kind: TokenKind::Num, value: Cow::Owned(self.source[start..self.pos].to_string()), suffix, line: sl, col: sc });
             } else if c == '"' {
                 let (sl, sc) = (self.line, self.col);
                 self.advance();
                 let mut val = String::new();
-                while let Some(nc) = self.peek(0) {
-                    if nc == '"' { break; }
-                    if nc == '\\' {
+                loop {
+                    let start = self.scan_bytes(|b| b != b'"' && b != b'\\');
+                    val.push_str(&self.source[start..self.pos]);
+                    if self.peek(0) == Some('\\') {
                         self.advance();
                         let esc = self.advance().unwrap();
                         let char_to_push = match esc {
                             'n' => '\n', 't' => '\t', 'r' => '\r', '"' => '"', '\\' => '\\',
                             'x' => {
-                                let h1 = self.advance().unwrap(); let h2 = self.advance().unwrap();
-                                u8::from_str_radix(&format!("{}{}", h1, h2), 16).unwrap() as char
+                                let hi = self.advance().unwrap().to_digit(16).unwrap();
+                                let lo = self.advance().unwrap().to_digit(16).unwrap();
+                                (hi * 16 + lo) as u8 as char
                             }
                             _ => { val.push('\\'); esc }
                         };
                         val.push(char_to_push);
-                    } else { val.push(self.advance().unwrap()); }
+                    } else { break; }
                 }
                 self.advance();
-                tokens.push(Token { kind: TokenKind::Str, value: val, line: sl, col: sc });
+                tokens.push(Token { kind: TokenKind::Str, value: Cow::Owned(val), suffix: None, line: sl, col: sc });
             } else {
                 let (sl, sc) = (self.line, self.col);
-                let mut sym = String::new();
-                for s in ["==", "!=", "<=", ">=", "->", "&&", "||"] {
-                    let mut match_s = true;
-                    for (j, sc) in s.chars().enumerate() {
-                        if self.peek(j) != Some(sc) { match_s = false; break; }
-                    }
-                    if match_s { sym = s.to_string(); break; }
-                }
-                if !sym.is_empty() {
-                    for _ in 0..sym.len() { self.advance(); }
+                let two = match (c, self.peek(1)) {
+                    ('=', Some('=')) => Some("=="), ('!', Some('=')) => Some("!="),
+                    ('<', Some('=')) => Some("<="), ('>', Some('=')) => Some(">="),
+                    ('-', Some('>')) => Some("->"), ('&', Some('&')) => Some("&&"),
+                    ('|', Some('|')) => Some("||"),
+                    _ => None,
+                };
+                let sym = if let Some(s) = two {
+                    self.advance(); self.advance();
+                    Cow::Borrowed(s)
                 } else {
-                    sym.push(self.advance().unwrap());
-                }
-                tokens.push(Token { kind: TokenKind::Sym, value: sym, line: sl, col: sc });
+                    let c = self.advance().unwrap();
+                    match SYMBOLS.find(c) {
+                        Some(i) => Cow::Borrowed(&SYMBOLS[i..i + 1]),
+                        None => Cow::Owned(c.to_string()),
+                    }
+                };
+                tokens.push(Token { kind: TokenKind::Sym, value: sym, suffix: None, line: sl, col: sc });
             }
         }
-        tokens.push(Token { kind: TokenKind::Eof, value: String::new(), line: self.line, col: self.col });
+        tokens.push(Token { kind: TokenKind::Eof, value: Cow::Borrowed(""), suffix: None, line: self.line, col: self.col });
         tokens
     }
 }
@@ -224,458 +342,515 @@ impl Parser {
     fn peek(&self, n: usize) -> &Token {
         if self.pos + n < self.tokens.len() { &self.tokens[self.pos + n] } else { &self.tokens[self.tokens.len() - 1] }
     }
-    fn consume(&mut self, kind: Option<TokenKind>, val: Option<&str>) -> Token {
-        let t = self.peek(0).clone();
+    fn at(&self, val: &str) -> bool { self.peek(0).value == val }
+    fn eat(&mut self, val: &str) -> bool {
+        if self.at(val) { self.pos += 1; true } else { false }
+    }
+    fn consume(&mut self, kind: Option<TokenKind>, val: Option<&str>) -> String {
+        let t = self.peek(0);
         if let Some(k) = kind { if t.kind != k { panic!("Expected {:?}, got {:?} at {}:{}", k, t.kind, t.line, t.col); } }
         if let Some(v) = val { if t.value != v { panic!("Expected {}, got {} at {}:{}", v, t.value, t.line, t.col); } }
+        // The parser never looks back, so the value can be moved out instead of cloned.
+        let i = self.pos.min(self.tokens.len() - 1);
         self.pos += 1;
-        t
+        std::mem::take(&mut self.tokens[i].value).into_owned()
     }
     fn parse_type(&mut self) -> String {
         let t = self.peek(0);
         if t.value == "[" {
             self.consume(None, Some("["));
             let ty = self.parse_type();
-            let sz = self.consume(Some(TokenKind::Num), None).value;
+            let sz = self.consume(Some(TokenKind::Num), None);
             self.consume(None, Some("]"));
             format!("[{} {}]", ty, sz)
         } else if t.value == "*" {
             self.consume(None, Some("*"));
             format!("*{}", self.parse_type())
-        } else { self.consume(Some(TokenKind::Ident), None).value }
+        } else { self.consume(Some(TokenKind::Ident), None) }
     }
-    fn parse_struct(&mut self) -> IRNode {
+    fn parse_struct(&mut self) -> IRNode<'static> {
         self.consume(Some(TokenKind::Ident), Some("struct"));
-        let name = self.consume(Some(TokenKind::Ident), None).value;
-        let mut fields = vec![IRNode::Atom("struct".to_string()), IRNode::Atom(name)];
-        if self.peek(0).value == "{" {
-            self.consume(None, Some("{"));
-            while self.peek(0).value != "}" {
-                let fn_name = self.consume(Some(TokenKind::Ident), None).value;
+        let name = self.consume(Some(TokenKind::Ident), None);
+        let mut fields = vec![IRNode::Atom("struct".into()), IRNode::Atom(name.into())];
+        if self.eat("{") {
+            while !self.at("}") {
+                let fn_name = self.consume(Some(TokenKind::Ident), None);
                 self.consume(None, Some(":"));
                 let ft = self.parse_type();
-                fields.push(IRNode::List(vec![IRNode::Atom("field".to_string()), IRNode::Atom(fn_name), IRNode::Atom(ft)]));
-                if self.peek(0).value == "," { self.consume(None, Some(",")); }
+                fields.push(IRNode::List(vec![IRNode::Atom("field".into()), IRNode::Atom(fn_name.into()), IRNode::Atom(ft.into())]));
+                self.eat(",");
             }
             self.consume(None, Some("}"));
         }
         IRNode::List(fields)
     }
-    fn parse_fn(&mut self) -> IRNode {
+    fn parse_fn(&mut self) -> IRNode<'static> {
         self.consume(Some(TokenKind::Ident), Some("fn"));
-        let name = self.consume(Some(TokenKind::Ident), None).value;
+        let name = self.consume(Some(TokenKind::Ident), None);
         self.consume(None, Some("("));
-        let mut params = vec![IRNode::Atom("params".to_string())];
-        while self.peek(0).value != ")" {
-            let pn = self.consume(Some(TokenKind::Ident), None).value;
+        let mut params = vec![IRNode::Atom("params".into())];
+        while !self.at(")") {
+            let pn = self.consume(Some(TokenKind::Ident), None);
             self.consume(None, Some(":"));
             let pt = self.parse_type();
-            params.push(IRNode::List(vec![IRNode::Atom("param".to_string()), IRNode::Atom(pn), IRNode::Atom(pt)]));
-            if self.peek(0).value == "," { self.consume(None, Some(",")); }
+            params.push(IRNode::List(vec![IRNode::Atom("param".into()), IRNode::Atom(pn.into()), IRNode::Atom(pt.into())]));
+            self.eat(",");
         }
         self.consume(None, Some(")"));
         let mut rt = "i32".to_string();
-        if self.peek(0).value == "returns" || self.peek(0).value == "->" {
+        if self.at("returns") || self.at("->") {
             self.consume(None, None);
             rt = self.parse_type();
         }
-        let mut block = vec![IRNode::Atom("block".to_string())];
-        if self.peek(0).value == "{" {
-            self.consume(None, Some("{"));
-            while self.peek(0).value != "}" { block.push(self.parse_stmt()); }
-            self.consume(None, Some("}"));
-        }
-        IRNode::List(vec![IRNode::Atom("fn".to_string()), IRNode::Atom(name), IRNode::List(params), IRNode::List(vec![IRNode::Atom("ret".to_string()), IRNode::Atom(rt)]), IRNode::List(block)])
+        let block = if self.at("{") { self.parse_block() } else { IRNode::List(vec![IRNode::Atom("block".into())]) };
+        IRNode::List(vec![IRNode::Atom("fn".into()), IRNode::Atom(name.into()), IRNode::List(params), IRNode::List(vec![IRNode::Atom("ret".into()), IRNode::Atom(rt.into())]), block])
+    }
+    fn parse_block(&mut self) -> IRNode<'static> {
+        self.consume(None, Some("{"));
+        let mut block = vec![IRNode::Atom("block".into())];
+        while !self.at("}") { block.push(self.parse_stmt()); }
+        self.consume(None, Some("}"));
+        IRNode::List(block)
     }
-    fn parse_stmt(&mut self) -> IRNode {
+    fn parse_stmt(&mut self) -> IRNode<'static> {
         let t = self.peek(0);
-        if t.value == "let" {
-            self.consume(None, Some("let"));
-            let n = self.consume(Some(TokenKind::Ident), None).value;
-            self.consume(None, Some(":"));
-            let ty = self.parse_type();
-            self.consume(None, Some("="));
-            let e = self.parse_expr();
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("let".to_string()), IRNode::Atom(n), IRNode::Atom(ty), e])
-        } else if t.value == "return" {
-            self.consume(None, Some("return"));
-            let e = self.parse_expr();
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("return".to_string()), e])
-        } else if t.value == "svc" {
-            self.consume(None, Some("svc"));
-            let mut args = vec![IRNode::Atom("svc".to_string())];
-            if self.peek(0).value == "(" {
-                self.consume(None, Some("("));
-                while self.peek(0).value != ")" {
-                    args.push(self.parse_expr());
-                    if self.peek(0).value == "," { self.consume(None, Some(",")); }
-                }
-                self.consume(None, Some(")"));
-            } else {
-                while self.peek(0).kind != TokenKind::Sym && self.peek(0).kind != TokenKind::Eof {
-                    args.push(self.parse_expr());
-                    if self.peek(0).value == "," { self.consume(None, Some(",")); }
+        match t.value.as_ref() {
+            "let" => {
+                self.consume(None, Some("let"));
+                let n = self.consume(Some(TokenKind::Ident), None);
+                self.consume(None, Some(":"));
+                let ty = self.parse_type();
+                self.consume(None, Some("="));
+                let e = self.parse_expr();
+                self.eat(";");
+                IRNode::List(vec![IRNode::Atom("let".into()), IRNode::Atom(n.into()), IRNode::Atom(ty.into()), e])
+            }
+            "return" => {
+                self.consume(None, Some("return"));
+                let e = self.parse_expr();
+                self.eat(";");
+                IRNode::List(vec![IRNode::Atom("return".into()), e])
+            }
+            "svc" => {
+                self.consume(None, Some("svc"));
+                let mut args = vec![IRNode::Atom("svc".into())];
+                if self.at("(") {
+                    self.parse_args(&mut args);
+                } else {
+                    while !matches!(self.peek(0).kind, TokenKind::Sym | TokenKind::Eof) {
+                        args.push(self.parse_expr());
+                        self.eat(",");
+                    }
                 }
+                self.eat(";");
+                IRNode::List(args)
             }
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(args)
-        } else if t.value == "syscall" {
-            self.consume(None, Some("syscall"));
-            let mut args = vec![IRNode::Atom("syscall".to_string())];
-            if self.peek(0).value == "(" {
-                self.consume(None, Some("("));
-                while self.peek(0).value != ")" {
-                    args.push(self.parse_expr());
-                    if self.peek(0).value == "," { self.consume(None, Some(",")); }
+            "syscall" => {
+                self.consume(None, Some("syscall"));
+                let mut args = vec![IRNode::Atom("syscall".into())];
+                if self.at("(") { self.parse_args(&mut args); }
+                self.eat(";");
+                IRNode::List(args)
+            }
+            "if" => {
+                self.consume(None, Some("if"));
+                let c = self.parse_expr();
+                let th = self.parse_block();
+                let mut res = vec![IRNode::Atom("if".into()), c, th];
+                if self.eat("else") {
+                    let el = self.parse_block();
+                    res.push(IRNode::List(vec![IRNode::Atom("else".into()), el]));
                 }
-                self.consume(None, Some(")"));
+                IRNode::List(res)
             }
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(args)
-        } else if t.value == "if" {
-            self.consume(None, Some("if"));
-            let c = self.parse_expr();
-            self.consume(None, Some("{"));
-            let mut th = vec![IRNode::Atom("block".to_string())];
-            while self.peek(0).value != "}" { th.push(self.parse_stmt()); }
-            self.consume(None, Some("}"));
-            let mut res = vec![IRNode::Atom("if".to_string()), c, IRNode::List(th)];
-            if self.peek(0).value == "else" {
-                self.consume(None, Some("else"));
-                self.consume(None, Some("{"));
-                let mut el = vec![IRNode::Atom("block".to_string())];
-                while self.peek(0).value != "}" { el.push(self.parse_stmt()); }
-                self.consume(None, Some("}"));
-                res.push(IRNode::List(vec![IRNode::Atom("else".to_string()), IRNode::List(el)]));
+            "while" => {
+                self.consume(None, Some("while"));
+                let c = self.parse_expr();
+                let b = self.parse_block();
+                IRNode::List(vec![IRNode::Atom("while".into()), c, b])
+            }
+            _ => {
+                let next = if t.kind == TokenKind::Ident { self.peek(1).value.as_ref() } else { "" };
+                match next {
+                    "[" => {
+                        let n = self.consume(Some(TokenKind::Ident), None);
+                        self.consume(None, Some("["));
+                        let idx = self.parse_expr();
+                        self.consume(None, Some("]"));
+                        self.consume(None, Some("="));
+                        let e = self.parse_expr();
+                        self.eat(";");
+                        IRNode::List(vec![IRNode::Atom("array_assign".into()), IRNode::Atom(n.into()), idx, e])
+                    }
+                    "=" => {
+                        let n = self.consume(Some(TokenKind::Ident), None);
+                        self.consume(None, Some("="));
+                        let e = self.parse_expr();
+                        self.eat(";");
+                        IRNode::List(vec![IRNode::Atom("assign".into()), IRNode::Atom(n.into()), e])
+                    }
+                    "." if self.peek(3).value == "=" => {
+                        let v = self.consume(Some(TokenKind::Ident), None);
+                        self.consume(None, Some("."));
+                        let f = self.consume(Some(TokenKind::Ident), None);
+                        self.consume(None, Some("="));
+                        let e = self.parse_expr();
+                        self.eat(";");
+                        IRNode::List(vec![IRNode::Atom("field_assign".into()), IRNode::Atom(v.into()), IRNode::Atom(f.into()), e])
+                    }
+                    _ => {
+                        let e = self.parse_expr();
+                        self.eat(";");
+                        IRNode::List(vec![IRNode::Atom("expr".into()), e])
+                    }
+                }
             }
-            IRNode::List(res)
-        } else if t.value == "while" {
-            self.consume(None, Some("while"));
-            let c = self.parse_expr();
-            self.consume(None, Some("{"));
-            let mut b = vec![IRNode::Atom("block".to_string())];
-            while self.peek(0).value != "}" { b.push(self.parse_stmt()); }
-            self.consume(None, Some("}"));
-            IRNode::List(vec![IRNode::Atom("while".to_string()), c, IRNode::List(b)])
-        } else if t.kind == TokenKind::Ident && self.peek(1).value == "[" {
-            let n = self.consume(Some(TokenKind::Ident), None).value;
-            self.consume(None, Some("["));
-            let idx = self.parse_expr();
-            self.consume(None, Some("]"));
-            self.consume(None, Some("="));
-            let e = self.parse_expr();
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("array_assign".to_string()), IRNode::Atom(n), idx, e])
-        } else if t.kind == TokenKind::Ident && self.peek(1).value == "=" {
-            let n = self.consume(Some(TokenKind::Ident), None).value;
-            self.consume(None, Some("="));
-            let e = self.parse_expr();
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("assign".to_string()), IRNode::Atom(n), e])
-        } else if t.kind == TokenKind::Ident && self.peek(1).value == "." && self.peek(3).value == "=" {
-            let v = self.consume(Some(TokenKind::Ident), None).value;
-            self.consume(None, Some("."));
-            let f = self.consume(Some(TokenKind::Ident), None).value;
-            self.consume(None, Some("="));
-            let e = self.parse_expr();
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("field_assign".to_string()), IRNode::Atom(v), IRNode::Atom(f), e])
-        } else {
-            let e = self.parse_expr();
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("expr".to_string()), e])
-        }
-    }
-    fn parse_expr(&mut self) -> IRNode { self.parse_or() }
-    fn parse_or(&mut self) -> IRNode {
-        let mut l = self.parse_and();
-        while self.peek(0).value == "||" || self.peek(0).value == "|" {
-            self.consume(None, None);
-            l = IRNode::List(vec![IRNode::Atom("binary".to_string()), IRNode::Atom("or".to_string()), l, self.parse_and()]);
         }
-        l
     }
-    fn parse_and(&mut self) -> IRNode {
-        let mut l = self.parse_cmp();
-        while self.peek(0).value == "&&" || self.peek(0).value == "&" {
-            self.consume(None, None);
-            l = IRNode::List(vec![IRNode::Atom("binary".to_string()), IRNode::Atom("and".to_string()), l, self.parse_cmp()]);
+    fn parse_args(&mut self, args: &mut Vec<IRNode<'static>>) {
+        self.consume(None, Some("("));
+        while !self.at(")") {
+            args.push(self.parse_expr());
+            self.eat(",");
         }
-        l
+        self.consume(None, Some(")"));
     }
-    fn parse_cmp(&mut self) -> IRNode {
-        let mut l = self.parse_add();
-        let ops: HashMap<&str, &str> = [("==", "eq"), ("!=", "ne"), ("<", "lt"), (">", "gt"), ("<=", "le"), (">=", "ge")].iter().cloned().collect();
-        let val = self.peek(0).value.as_str();
-        if let Some(&op) = ops.get(val) {
+    fn parse_expr(&mut self) -> IRNode<'static> { self.parse_binary(1) }
+    // Precedence climbing over BINARY_OPS. Comparisons do not chain, matching the old
+    // parse_cmp: `a < b < c` stops after `a < b`.
+    fn parse_binary(&mut self, min_prec: u8) -> IRNode<'static> {
+        let mut l = self.parse_term();
+        let mut last = u8::MAX;
+        while let Some(&(_, prec, op)) = BINARY_OPS.iter().find(|(sym, _, _)| self.peek(0).value == *sym) {
+            if prec < min_prec || prec > last || (prec == last && prec == CMP_PREC) { break; }
             self.consume(None, None);
-            l = IRNode::List(vec![IRNode::Atom("binary".to_string()), IRNode::Atom(op.to_string()), l, self.parse_add(), IRNode::Atom("bool".to_string())]);
+            let r = self.parse_binary(prec + 1);
+            let mut node = vec![IRNode::Atom("binary".into()), IRNode::Atom(op.into()), l, r];
+            if prec == CMP_PREC { node.push(IRNode::Atom("bool".into())); }
+            l = IRNode::List(node);
+            last = prec;
         }
         l
     }
-    fn parse_add(&mut self) -> IRNode {
-        let mut l = self.parse_mul();
-        while self.peek(0).value == "+" || self.peek(0).value == "-" {
-            let op = if self.consume(None, None).value == "+" { "add" } else { "sub" };
-            l = IRNode::List(vec![IRNode::Atom("binary".to_string()), IRNode::Atom(op.to_string()), l, self.parse_mul()]);
+    fn parse_term(&mut self) -> IRNode<'static> {
+        let t = self.peek(0);
+        match t.value.as_ref() {
+            "!" => {
+                self.consume(None, None);
+                IRNode::List(vec![IRNode::Atom("binary".into()), IRNode::Atom("eq".into()), self.parse_term(), IRNode::List(vec![IRNode::Atom("int".into()), IRNode::Atom("0".into())]), IRNode::Atom("bool".into())])
+            }
+            "svc" => {
+                self.consume(None, None);
+                let imm = self.consume(Some(TokenKind::Num), None);
+                self.eat(";");
+                IRNode::List(vec![IRNode::Atom("svc".into()), IRNode::Atom(imm.into())])
+            }
+            "syscall" => {
+                self.consume(None, None);
+                self.eat(";");
+                IRNode::List(vec![IRNode::Atom("syscall".into())])
+            }
+            "(" => {
+                self.consume(None, Some("("));
+                let e = self.parse_expr();
+                self.consume(None, Some(")"));
+                e
+            }
+            "[" => {
+                self.consume(None, Some("["));
+                let val = self.parse_expr();
+                let sz = self.consume(Some(TokenKind::Num), None);
+                self.consume(None, Some("]"));
+                IRNode::List(vec![IRNode::Atom("array_lit".into()), val, IRNode::Atom(sz.into())])
+            }
+            _ => match t.kind {
+                TokenKind::Num => {
+                    let suffix = t.suffix;
+                    let mut v = self.consume(None, None);
+                    let tag = match suffix {
+                        Some((suf, tag)) => { v.truncate(v.len() - suf.len()); tag }
+                        None => "int",
+                    };
+                    IRNode::List(vec![IRNode::Atom(tag.into()), IRNode::Atom(v.into())])
+                }
+                TokenKind::Str => IRNode::List(vec![IRNode::Atom("string_typed".into()), IRNode::Atom(self.consume(None, None).into())]),
+                TokenKind::Ident => self.parse_ident_term(),
+                _ => panic!("Unexpected token {:?}", t),
+            },
         }
-        l
     }
-    fn parse_mul(&mut self) -> IRNode {
-        let mut l = self.parse_term();
-        while self.peek(0).value == "*" || self.peek(0).value == "/" {
-            let op = if self.consume(None, None).value == "*" { "mul" } else { "div" };
-            l = IRNode::List(vec![IRNode::Atom("binary".to_string()), IRNode::Atom(op.to_string()), l, self.parse_term()]);
+    fn parse_ident_term(&mut self) -> IRNode<'static> {
+        let n = self.consume(Some(TokenKind::Ident), None);
+        match n.as_str() {
+            "true" => return IRNode::List(vec![IRNode::Atom("bool".into()), IRNode::Atom("1".into())]),
+            "false" => return IRNode::List(vec![IRNode::Atom("bool".into()), IRNode::Atom("0".into())]),
+            _ => {}
         }
-        l
-    }
-    fn parse_term(&mut self) -> IRNode {
-        let t = self.peek(0).clone();
-        if t.value == "!" {
-            self.consume(None, None);
-            IRNode::List(vec![IRNode::Atom("binary".to_string()), IRNode::Atom("eq".to_string()), self.parse_term(), IRNode::List(vec![IRNode::Atom("int".to_string()), IRNode::Atom("0".to_string())]), IRNode::Atom("bool".to_string())])
-        } else if t.value == "svc" {
-            self.consume(None, None);
-            let imm = self.consume(Some(TokenKind::Num), None).value;
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("svc".to_string()), IRNode::Atom(imm)])
-        } else if t.value == "syscall" {
-            self.consume(None, None);
-            if self.peek(0).value == ";" { self.consume(None, Some(";")); }
-            IRNode::List(vec![IRNode::Atom("syscall".to_string())])
-        } else if t.value == "(" {
-            self.consume(None, Some("("));
-            let e = self.parse_expr();
-            self.consume(None, Some(")"));
-            e
-        } else if t.value == "[" {
-            self.consume(None, Some("["));
-            let val = self.parse_expr();
-            let sz = self.consume(Some(TokenKind::Num), None).value;
-            self.consume(None, Some("]"));
-            IRNode::List(vec![IRNode::Atom("array_lit".to_string()), val, IRNode::Atom(sz)])
-        } else if t.kind == TokenKind::Num {
-            let v = self.consume(Some(TokenKind::Num), None).value;
-            if v.ends_with("i64") { IRNode::List(vec![IRNode::Atom("int_i64".to_string()), IRNode::Atom(v[..v.len()-3].to_string())]) }
-            else if v.ends_with("f32") { IRNode::List(vec![IRNode::Atom("f32".to_string()), IRNode::Atom(v[..v.len()-3].to_string())]) }
-            else if v.ends_with("f64") { IRNode::List(vec![IRNode::Atom("f64".to_string()), IRNode::Atom(v[..v.len()-3].to_string())]) }
-            else if v.ends_with("i32") { IRNode::List(vec![IRNode::Atom("int".to_string()), IRNode::Atom(v[..v.len()-3].to_string())]) }
-            else { IRNode::List(vec![IRNode::Atom("int".to_string()), IRNode::Atom(v)]) }
-        } else if t.kind == TokenKind::Str {
-            IRNode::List(vec![IRNode::Atom("string_typed".to_string()), IRNode::Atom(self.consume(Some(TokenKind::Str), None).value)])
-        } else if t.kind == TokenKind::Ident {
-            let n = self.consume(Some(TokenKind::Ident), None).value;
-            if n == "true" || n == "false" { return IRNode::List(vec![IRNode::Atom("bool".to_string()), IRNode::Atom(if n == "true" { "1" } else { "0" }.to_string())]); }
-            if self.peek(0).value == "{" {
+        match self.peek(0).value.as_ref() {
+            "{" => {
                 self.consume(None, Some("{"));
-                let mut fields = vec![IRNode::Atom("struct_lit".to_string()), IRNode::Atom(n)];
-                while self.peek(0).value != "}" {
+                let mut fields = vec![IRNode::Atom("struct_lit".into()), IRNode::Atom(n.into())];
+                while !self.at("}") {
                     self.consume(Some(TokenKind::Ident), None); self.consume(None, Some(":"));
                     fields.push(self.parse_expr());
-                    if self.peek(0).value == "," { self.consume(None, Some(",")); }
+                    self.eat(",");
                 }
                 self.consume(None, Some("}"));
-                return IRNode::List(fields);
+                IRNode::List(fields)
             }
-            if self.peek(0).value == "(" {
-                self.consume(None, Some("("));
-                let mut args = Vec::new();
-                while self.peek(0).value != ")" {
-                    args.push(self.parse_expr());
-                    if self.peek(0).value == "," { self.consume(None, Some(",")); }
+            "(" => {
+                let (line, col) = (self.peek(0).line, self.peek(0).col);
+                let builtin = n == "str_len" || n == "str_ptr";
+                let mut call = if builtin { vec![IRNode::Atom(n.into())] } else { vec![IRNode::Atom("call".into()), IRNode::Atom(n.into())] };
+                self.parse_args(&mut call);
+                if builtin {
+                    if call.len() < 2 { panic!("{} expects an argument at {}:{}", call[0].as_atom().unwrap_or_default(), line, col); }
+                    call.truncate(2);
                 }
-                self.consume(None, Some(")"));
-                if n == "str_len" { return IRNode::List(vec![IRNode::Atom("str_len".to_string()), args[0].clone()]); }
-                if n == "str_ptr" { return IRNode::List(vec![IRNode::Atom("str_ptr".to_string()), args[0].clone()]); }
-                let mut call = vec![IRNode::Atom("call".to_string()), IRNode::Atom(n)];
-                call.extend(args);
-                return IRNode::List(call);
+                IRNode::List(call)
             }
-            if self.peek(0).value == "." {
+            "." => {
                 self.consume(None, Some("."));
-                return IRNode::List(vec![IRNode::Atom("field".to_string()), IRNode::Atom(n), IRNode::Atom(self.consume(Some(TokenKind::Ident), None).value)]);
+                IRNode::List(vec![IRNode::Atom("field".into()), IRNode::Atom(n.into()), IRNode::Atom(self.consume(Some(TokenKind::Ident), None).into())])
             }
-            if self.peek(0).value == "[" {
+            "[" => {
                 self.consume(None, Some("["));
                 let idx = self.parse_expr();
                 self.consume(None, Some("]"));
-                return IRNode::List(vec![IRNode::Atom("array_index".to_string()), IRNode::Atom(n), idx]);
+                IRNode::List(vec![IRNode::Atom("array_index".into()), IRNode::Atom(n.into()), idx])
             }
-            IRNode::List(vec![IRNode::Atom("ident".to_string()), IRNode::Atom(n)])
-        } else { panic!("Unexpected token {:?}", t) }
+            _ => IRNode::List(vec![IRNode::Atom("ident".into()), IRNode::Atom(n.into())]),
+        }
     }
 }
 
 fn parse_file_recursive(filepath: PathBuf, visited: &mut HashSet<PathBuf>, all_structs: &mut Vec<IRNode>, all_fns: &mut Vec<IRNode>, _all_imports: &mut Vec<IRNode>) {
     let filepath = fs::canonicalize(filepath).expect("Failed to canonicalize path");
-    if visited.contains(&filepath) { return; }
-    visited.insert(filepath.clone());
+    if !visited.insert(filepath.clone()) { return; }
     let source = fs::read_to_string(&filepath).expect("Failed to read file");
     let mut lexer = Lexer::new(source);
     let tokens = lexer.tokenize();
     let mut parser = Parser::new(tokens);
     
     let mut imports = Vec::new();
-    let mut structs = Vec::new();
-    let mut fns = Vec::new();
     
-    while parser.peek(0).kind != TokenKind::Eof {
+    loop {
         let t = parser.peek(0);
-        if t.value == "import" {
-            parser.consume(None, None);
-            let imp = parser.consume(Some(TokenKind::Str), None).value;
-            imports.push(imp);
-        } else if t.value == "struct" { structs.push(parser.parse_struct()); }
-        else if t.value == "fn" { fns.push(parser.parse_fn()); }
-        else { parser.pos += 1; }
+        if t.kind == TokenKind::Eof { break; }
+        match t.value.as_ref() {
+            "import" => {
+                parser.consume(None, None);
+                imports.push(parser.consume(Some(TokenKind::Str), None));
+            }
+            "struct" => all_structs.push(parser.parse_struct()),
+            "fn" => all_fns.push(parser.parse_fn()),
+            _ => parser.pos += 1,
+        }
     }
     
-    all_structs.extend(structs);
-    all_fns.extend(fns);
     for imp in imports {
-        let mut imp_path = filepath.parent().unwrap().to_path_buf();
-        imp_path.push(format!("{}.coatl", imp));
+        let imp_path = filepath.parent().unwrap().join(format!("{}.coatl", imp));
         parse_file_recursive(imp_path, visited, all_structs, all_fns, _all_imports);
     }
 }
 
 use intrinsics::{INTRINSICS_X86_64, INTRINSICS_AARCH64};
 
-struct X86_64Backend {
-    ir: IRNode,
-    output: Vec<String>,
+const X86_64_PRELUDE: &str = ".intel_syntax noprefix
+.bss
+.align 16
+.globl __coatl_mem
+__coatl_mem:
+  .zero 1048576
+.text";
+// The entry point runs exactly once, so it fills the arena inline between these two halves.
+// It is emitted after the functions, once every string literal has been given its arena offset.
+const X86_64_START: &str = ".globl coatl_start
+coatl_start:";
+const X86_64_START_TAIL: &str = "  call main
+  mov edi, eax; mov eax, 60; syscall";
+const X86_64_ARG_REGS: [&str; 6] = ["rdi", "rsi", "rdx", "rcx", "r8", "r9"];
+const AARCH64_ARG_REGS: [&str; 8] = ["x0", "x1", "x2", "x3", "x4", "x5", "x6", "x7"];
+const AARCH64_PRELUDE: &str = ".bss
+.align 4
+.globl __coatl_mem
+__coatl_mem:
+  .zero 1048576
+.text";
+const AARCH64_START: &str = ".globl coatl_start
+coatl_start:
+  stp x29, x30, [sp, #-16]!";
+const AARCH64_START_TAIL: &str = "  bl main
+  mov w0, w0; mov x8, #93; svc #0";
+
+// One pass over the top-level sections registers structs; returns the functions.
+fn scan_sections<'a, 'ir>(ir: &'a IRNode<'ir>, structs: &mut HashMap<String, HashMap<String, i32>>) -> &'a [IRNode<'ir>] {
+    let mut fns: &[IRNode] = &[];
+    if let IRNode::List(root) = ir {
+        for child in root.iter().filter_map(|c| c.as_list()) {
+            match child.first().and_then(|h| h.as_atom()) {
+                Some("functions") => fns = &child[1..],
+                Some("structs") => {
+                    for s in &child[1..] {
+                        if let IRNode::List(sl) = s {
+                            let name = sl[1].as_atom().unwrap().to_string();
+                            let fields = sl[2..].iter().enumerate().map(|(i, f)| (f.as_list().unwrap()[1].as_atom().unwrap().to_string(), i as i32 * 4)).collect();
+                            structs.insert(name, fields);
+                        }
+                    }
+                }
+                _ => {}
+            }
+        }
+    }
+    fns
+}
+
+// Right-hand operands that load into a register without touching the left one, so binary
+// lowering can skip spilling the left value to the stack.
+fn is_simple_operand(n: &IRNode) -> bool {
+    matches!(n.as_list().and_then(|l| l.first()).and_then(|h| h.as_atom()), Some("int" | "int_i64" | "bool" | "ident"))
+}
+
+// Splits a binary node into (op, lhs, rhs). When only the left operand is simple, the operands are
+// exchanged where the op allows it, so the simple side can still be loaded without a spill.
+// A literal or local has no side effects, so evaluating it second is safe.
+fn binary_operands<'a, 'ir>(l: &'a [IRNode<'ir>]) -> (&'a str, &'a IRNode<'ir>, &'a IRNode<'ir>) {
+    let op = l[1].as_atom().unwrap();
+    if is_simple_operand(&l[3]) || !is_simple_operand(&l[2]) { return (op, &l[2], &l[3]); }
+    let swapped = match op {
+        "add" | "mul" | "and" | "or" | "eq" | "ne" => op,
+        "lt" => "gt", "gt" => "lt", "le" => "ge", "ge" => "le",
+        _ => return (op, &l[2], &l[3]),
+    };
+    (swapped, &l[3], &l[2])
+}
+
+// Frame size for locals reaching `deepest` bytes below the frame pointer, 16-byte aligned.
+// Both backends reserve the frame with a single immediate subtract. AArch64's `sub sp, sp, #imm`
+// only encodes a 12-bit immediate, optionally shifted left by 12, so a frame of 4096 bytes or more
+// is rounded up to a multiple of 4096 to stay encodable.
+fn frame_size(deepest: i32) -> i32 {
+    let frame = (deepest + 15) & !15;
+    if frame < 4096 { frame } else { (frame + 4095) & !4095 }
+}
+
+// String literals are copied into the memory arena at this offset by coatl_start.
+const STRINGS_BASE: i32 = 65536;
+
+// String literals in the order lowering first reaches them, each with its arena offset.
+// The literals are laid out back to back, NUL-terminated, as .byte rows for the read-only data section.
+struct StringTable {
+    offsets: HashMap<String, i32>,
+    rows: String,
+    len: i32,
+}
+
+impl StringTable {
+    fn new() -> Self {
+        Self { offsets: HashMap::new(), rows: String::new(), len: 0 }
+    }
+
+    fn offset(&mut self, s: &str) -> i32 {
+        if let Some(&off) = self.offsets.get(s) { return off; }
+        let off = STRINGS_BASE + self.len;
+        self.rows.push_str("  .byte ");
+        for b in s.bytes() { let _ = write!(self.rows, "{}, ", b); }
+        self.rows.push_str("0\n");
+        self.len += s.len() as i32 + 1;
+        self.offsets.insert(s.to_string(), off);
+        off
+    }
+}
+
+// Formats an assembly line straight into a backend's output buffer, with no intermediate String.
+macro_rules! emit {
+    ($backend:expr, $($arg:tt)*) => {{ let _ = writeln!($backend.output, $($arg)*); }};
+}
+
+struct X86_64Backend<'a> {
+    ir: IRNode<'a>,
+    output: String,
     vars: HashMap<String, (i32, String)>,
-    strings: HashMap<String, i32>,
-    structs: HashMap<String, Vec<String>>,
+    strings: StringTable,
+    structs: HashMap<String, HashMap<String, i32>>,
     label_count: i32,
     current_fn: String,
+    makes_calls: bool,
 }
 
-impl X86_64Backend {
-    fn new(ir: IRNode) -> Self {
+impl<'a> X86_64Backend<'a> {
+    fn new(ir: IRNode<'a>) -> Self {
         Self {
             ir,
-            output: Vec::new(),
+            output: String::new(),
             vars: HashMap::new(),
-            strings: HashMap::new(),
+            strings: StringTable::new(),
             structs: HashMap::new(),
             label_count: 0,
             current_fn: String::new(),
+            makes_calls: false,
         }
     }
 
-    fn emit(&mut self, s: String) { self.output.push(s); }
+    fn emit(&mut self, s: impl AsRef<str>) { self.output.push_str(s.as_ref()); self.output.push('\n'); }
+    fn emit_string_data(&mut self) {
+        if self.strings.len == 0 { return; }
+        self.emit(".section .rodata\n.L_str_data:");
+        self.output.push_str(&self.strings.rows);
+        self.emit(".text");
+    }
     fn new_label(&mut self, prefix: &str) -> String {
         self.label_count += 1;
         format!(".{}{}", prefix, self.label_count)
     }
-
-    fn collect_strings(&mut self, node: &IRNode) {
-        if let IRNode::List(l) = node {
-            if !l.is_empty() {
-                if let Some(atom) = l[0].as_atom() {
-                    if atom == "string_typed" && l.len() > 1 {
-                        if let Some(val) = l[1].as_atom() {
-                            self.strings.insert(val.clone(), 0);
-                        }
-                    }
-                }
-            }
-            for child in l { self.collect_strings(child); }
-        }
+    fn field_offset(&self, var_name: &str, field_name: &str) -> i32 {
+        let (off, ty) = &self.vars[var_name];
+        off - self.structs[ty][field_name]
     }
 
     fn lower(&mut self) {
-        let mut fns: Vec<IRNode> = Vec::new();
-        let mut structs_list: Vec<IRNode> = Vec::new();
+        let ir = std::mem::replace(&mut self.ir, IRNode::List(Vec::new()));
+        let fns = scan_sections(&ir, &mut self.structs);
+        // The fixed runtime text is known up front; reserve it so the output buffer is not regrown as it fills.
+        self.output.reserve(X86_64_PRELUDE.len() + X86_64_START.len() + X86_64_START_TAIL.len() + INTRINSICS_X86_64.len() + 4);
 
-        if let IRNode::List(root) = &self.ir {
-            for child in root {
-                if let IRNode::List(c) = child {
-                    if !c.is_empty() {
-                        if c[0].as_atom().map(|s| s == "functions").unwrap_or(false) {
-                            fns = c[1..].to_vec();
-                        } else if c[0].as_atom().map(|s| s == "structs").unwrap_or(false) {
-                            structs_list = c[1..].to_vec();
-                        }
-                    }
-                }
-            }
-        }
+        self.emit(X86_64_PRELUDE);
 
-        for s in structs_list {
-            if let IRNode::List(sl) = s {
-                let name = sl[1].as_atom().unwrap().clone();
-                let fields = sl[2..].iter().map(|f| f.as_list().unwrap()[1].as_atom().unwrap().clone()).collect();
-                self.structs.insert(name, fields);
-            }
-        }
+        // String literals get their offsets as the functions are lowered, so the startup code comes after them.
+        for func in fns { self.lower_fn(func); }
 
-        self.emit(".intel_syntax noprefix".to_string());
-        self.emit(".bss".to_string());
-        self.emit(".align 16".to_string());
-        self.emit(".globl __coatl_mem".to_string());
-        self.emit("__coatl_mem:".to_string());
-        self.emit("  .zero 1048576".to_string());
-        self.emit("__coatl_mem_inited:".to_string());
-        self.emit("  .long 0".to_string());
-        self.emit(".text".to_string());
-        self.emit("__coatl_init_memory:".to_string());
-        self.emit("  push rbp; mov rbp, rsp".to_string());
-        self.emit("  mov eax, dword ptr [rip+__coatl_mem_inited]; test eax, eax; jne .L_mem_done".to_string());
-        self.emit("  mov dword ptr [rip+__coatl_mem_inited], 1".to_string());
-        self.emit("  lea rdx, [rip+__coatl_mem]".to_string());
-
-        for func in &fns { self.collect_strings(func); }
-
-        let mut off: i32 = 65536;
-        let mut sorted_strings: Vec<_> = self.strings.keys().cloned().collect();
-        sorted_strings.sort();
-        for s in sorted_strings {
-            let bytes = s.as_bytes().to_vec();
-            for (i, &b) in bytes.iter().enumerate() {
-                self.emit(format!("  mov byte ptr [rdx+{}], {}", off + i as i32, b));
-            }
-            self.emit(format!("  mov byte ptr [rdx+{}], 0", off + bytes.len() as i32));
-            self.strings.insert(s, off);
-            off += bytes.len() as i32 + 1;
+        self.emit(X86_64_START);
+        if self.strings.len > 0 {
+            // Copy the literals into the arena in one go instead of storing them a byte at a time.
+            emit!(self, "  lea rdi, [rip+__coatl_mem+{}]; lea rsi, [rip+.L_str_data]; mov ecx, {}; rep movsb", STRINGS_BASE, self.strings.len);
         }
-
-        self.emit(".L_mem_done:".to_string());
-        self.emit("  pop rbp; ret".to_string());
-
-        for func in fns { self.lower_fn(&func); }
-
-        self.emit(".globl coatl_start".to_string());
-        self.emit("coatl_start:".to_string());
-        self.emit("  call __coatl_init_memory".to_string());
-        self.emit("  call main".to_string());
-        self.emit("  mov edi, eax; mov eax, 60; syscall".to_string());
-        self.emit(INTRINSICS_X86_64.to_string());
+        self.emit(X86_64_START_TAIL);
+        self.emit_string_data();
+        self.emit(INTRINSICS_X86_64);
+        self.ir = ir;
     }
 
     fn lower_fn(&mut self, n: &IRNode) {
         if let IRNode::List(l) = n {
             let name = l[1].as_atom().unwrap();
-            self.current_fn = name.clone();
+            self.current_fn = name.to_string();
             self.vars.clear();
-            self.emit(format!(".global {}\n{}:", name, name));
-            self.emit("  push rbp; mov rbp, rsp; sub rsp, 4096".to_string());
+            self.makes_calls = false;
+            emit!(self, ".global {0}\n{0}:", name);
+            let frame_at = self.output.len();
             
-            let regs = ["rdi", "rsi", "rdx", "rcx", "r8", "r9"];
             if let IRNode::List(params) = &l[2] {
                 for (i, p) in params[1..].iter().enumerate() {
                     if let IRNode::List(pl) = p {
                         let p_name = pl[1].as_atom().unwrap();
                         let p_type = pl[2].as_atom().unwrap();
                         let off = (i as i32 + 1) * 8;
-                        self.vars.insert(p_name.clone(), (off, p_type.clone()));
-                        if i < 6 { self.emit(format!("  mov [rbp-{}], {}", off, regs[i])); }
+                        self.vars.insert(p_name.to_string(), (off, p_type.to_string()));
+                        if i < 6 { emit!(self, "  mov [rbp-{}], {}", off, X86_64_ARG_REGS[i]); }
                         else {
                             let stack_off = 16 + (i as i32 - 6) * 8;
-                            self.emit(format!("  mov rax, [rbp+{}]\n  mov [rbp-{}], rax", stack_off, off));
+                            emit!(self, "  mov rax, [rbp+{}]\n  mov [rbp-{}], rax", stack_off, off);
                         }
                     }
                 }
@@ -684,302 +859,266 @@ impl X86_64Backend {
             if let IRNode::List(body) = &l[4] {
                 for stmt in &body[1..] { self.lower_stmt(stmt); }
             }
-            self.emit(format!(".Lret_{}:; leave; ret", name));
+            // Slots are handed out while the body is lowered, so the frame is set up afterwards.
+            // A leaf with no slots never addresses through rbp and needs no frame at all.
+            if self.makes_calls || !self.vars.is_empty() {
+                let frame = frame_size(self.vars.values().map(|v| v.0).max().unwrap_or(0));
+                self.output.insert_str(frame_at, &format!("  push rbp; mov rbp, rsp; sub rsp, {}\n", frame));
+                emit!(self, ".Lret_{}:; leave; ret", name);
+            } else {
+                emit!(self, ".Lret_{}:; ret", name);
+            }
         }
     }
 
     fn lower_stmt(&mut self, n: &IRNode) {
         let l = n.as_list().unwrap();
         let head = l[0].as_atom().unwrap();
-        match head.as_str() {
+        match head {
             "let" => {
                 let name = l[1].as_atom().unwrap();
                 let vtype = l[2].as_atom().unwrap();
                 let off = (self.vars.len() as i32 + 1) * 8;
-                self.vars.insert(name.clone(), (off, vtype.clone()));
+                self.vars.insert(name.to_string(), (off, vtype.to_string()));
                 self.lower_expr(&l[3]);
-                self.emit(format!("  mov [rbp-{}], rax", off));
+                emit!(self, "  mov [rbp-{}], rax", off);
             }
             "assign" => {
                 let name = l[1].as_atom().unwrap();
                 let off = self.vars.get(name).unwrap().0;
                 self.lower_expr(&l[2]);
-                self.emit(format!("  mov [rbp-{}], rax", off));
+                emit!(self, "  mov [rbp-{}], rax", off);
             }
             "field_assign" => {
                 let var_name = l[1].as_atom().unwrap();
                 let field_name = l[2].as_atom().unwrap();
-                let (off, ty) = self.vars.get(var_name).unwrap().clone();
-                let fi = self.structs.get(&ty).unwrap().iter().position(|f| f == field_name).unwrap();
+                let off = self.field_offset(var_name, field_name);
                 self.lower_expr(&l[3]);
-                self.emit(format!("  mov dword ptr [rbp-{}], eax", off - (fi as i32 * 4)));
+                emit!(self, "  mov dword ptr [rbp-{}], eax", off);
             }
             "if" => {
                 let l_else = self.new_label("L_else");
                 let l_end = self.new_label("L_end");
                 self.lower_expr(&l[1]);
-                self.emit("  cmp rax, 0; je ".to_string() + &l_else);
+                emit!(self, "  cmp rax, 0; je {}", l_else);
                 self.lower_stmt(&l[2]);
-                self.emit("  jmp ".to_string() + &l_end);
-                self.emit(l_else + ":");
+                emit!(self, "  jmp {}\n{}:", l_end, l_else);
                 if l.len() > 3 { self.lower_stmt(&l[3].as_list().unwrap()[1]); }
-                self.emit(l_end + ":");
+                emit!(self, "{}:", l_end);
             }
             "while" => {
                 let l_start = self.new_label("L_while_start");
                 let l_end = self.new_label("L_while_end");
-                self.emit(l_start.clone() + ":");
+                emit!(self, "{}:", l_start);
                 self.lower_expr(&l[1]);
-                self.emit("  cmp rax, 0; je ".to_string() + &l_end);
+                emit!(self, "  cmp rax, 0; je {}", l_end);
                 self.lower_stmt(&l[2]);
-                self.emit("  jmp ".to_string() + &l_start);
-                self.emit(l_end + ":");
+                emit!(self, "  jmp {}\n{}:", l_start, l_end);
             }
             "block" => { for s in &l[1..] { self.lower_stmt(s); } }
             "return" => {
                 self.lower_expr(&l[1]);
                 let label = format!(".Lret_{}", self.current_fn);
-                self.emit(format!("  jmp {}", label));
+                emit!(self, "  jmp {}", label);
             }
             "expr" => { self.lower_expr(&l[1]); }
             _ => {}
         }
     }
 
+    // Loads a literal or local straight into rcx, leaving the left operand in rax untouched.
+    fn lower_operand_rcx(&mut self, n: &IRNode) {
+        let l = n.as_list().unwrap();
+        if l[0].as_atom() == Some("ident") {
+            let off = self.vars.get(l[1].as_atom().unwrap()).unwrap().0;
+            emit!(self, "  mov rcx, [rbp-{}]", off);
+        } else {
+            emit!(self, "  mov rcx, {}", l[1].as_atom().unwrap());
+        }
+    }
+
     fn lower_expr(&mut self, n: &IRNode) {
         let l = n.as_list().unwrap();
         let head = l[0].as_atom().unwrap();
-        match head.as_str() {
-            "int" | "int_i64" | "bool" | "f32" | "f64" => {
-                let val = l[1].as_atom().unwrap();
-                if head == "f32" {
-                    let f: f32 = val.parse().unwrap();
-                    self.emit(format!("  mov eax, {}; movd xmm0, eax; movss rax, xmm0", f.to_bits()));
-                } else if head == "f64" {
-                    let f: f64 = val.parse().unwrap();
-                    self.emit(format!("  mov rax, {}; movd xmm0, rax; movsd rax, xmm0", f.to_bits()));
-                } else {
-                    self.emit(format!("  mov rax, {}", val));
-                }
+        match head {
+            "int" | "int_i64" | "bool" => emit!(self, "  mov rax, {}", l[1].as_atom().unwrap()),
+            "f32" => {
+                let f: f32 = l[1].as_atom().unwrap().parse().unwrap();
+                emit!(self, "  mov eax, {}; movd xmm0, eax; movss rax, xmm0", f.to_bits());
+            }
+            "f64" => {
+                let f: f64 = l[1].as_atom().unwrap().parse().unwrap();
+                emit!(self, "  mov rax, {}; movd xmm0, rax; movsd rax, xmm0", f.to_bits());
             }
             "ident" => {
                 let name = l[1].as_atom().unwrap();
                 let off = self.vars.get(name).unwrap().0;
-                self.emit(format!("  mov rax, [rbp-{}]", off));
+                emit!(self, "  mov rax, [rbp-{}]", off);
             }
             "field" => {
                 let var_name = l[1].as_atom().unwrap();
                 let field_name = l[2].as_atom().unwrap();
-                let (off, ty) = self.vars.get(var_name).unwrap().clone();
-                let fi = self.structs.get(&ty).unwrap().iter().position(|f| f == field_name).unwrap();
-                self.emit(format!("  movsxd rax, dword ptr [rbp-{}]", off - (fi as i32 * 4)));
+                let off = self.field_offset(var_name, field_name);
+                emit!(self, "  movsxd rax, dword ptr [rbp-{}]", off);
             }
             "struct_lit" => {
                 for (i, arg) in l[2..4].iter().enumerate() {
                     self.lower_expr(arg);
                     if i == 0 {
-                        self.emit("  push rax".to_string());
+                        self.emit("  push rax");
                     } else {
-                        self.emit("  shl rax, 32; pop rcx; or rax, rcx".to_string());
+                        self.emit("  shl rax, 32; pop rcx; or rax, rcx");
                     }
                 }
             }
             "binary" => {
-                let op = l[1].as_atom().unwrap();
-                self.lower_expr(&l[2]); self.emit("  push rax".to_string());
-                self.lower_expr(&l[3]); self.emit("  mov rcx, rax; pop rax".to_string());
-                match op.as_str() {
-                    "add" => self.emit("  add rax, rcx".to_string()),
-                    "sub" => self.emit("  sub rax, rcx".to_string()),
-                    "mul" => self.emit("  imul rax, rcx".to_string()),
-                    "div" => self.emit("  cqo; idiv rcx".to_string()),
-                    "and" => self.emit("  and rax, rcx".to_string()),
-                    "or" => self.emit("  or rax, rcx".to_string()),
-                    _ => {
-                        let cond = match op.as_str() { "eq"=>"e", "ne"=>"ne", "lt"=>"l", "gt"=>"g", "le"=>"le", "ge"=>"ge", _=>"e" };
-                        self.emit(format!("  cmp rax, rcx; set{} al; movzx rax, al", cond));
-                    }
+                let (op, lhs, rhs) = binary_operands(l);
+                if is_simple_operand(rhs) {
+                    self.lower_expr(lhs);
+                    self.lower_operand_rcx(rhs);
+                } else {
+                    self.lower_expr(lhs); self.emit("  push rax");
+                    self.lower_expr(rhs); self.emit("  mov rcx, rax; pop rax");
+                }
+                match op {
+                    "add" => self.emit("  add rax, rcx"),
+                    "sub" => self.emit("  sub rax, rcx"),
+                    "mul" => self.emit("  imul rax, rcx"),
+                    "div" => self.emit("  cqo; idiv rcx"),
+                    "and" => self.emit("  and rax, rcx"),
+                    "or" => self.emit("  or rax, rcx"),
+                    "ne" => self.emit("  cmp rax, rcx; setne al; movzx rax, al"),
+                    "lt" => self.emit("  cmp rax, rcx; setl al; movzx rax, al"),
+                    "gt" => self.emit("  cmp rax, rcx; setg al; movzx rax, al"),
+                    "le" => self.emit("  cmp rax, rcx; setle al; movzx rax, al"),
+                    "ge" => self.emit("  cmp rax, rcx; setge al; movzx rax, al"),
+                    _ => self.emit("  cmp rax, rcx; sete al; movzx rax, al"),
                 }
             }
             "call" => {
                 let name = l[1].as_atom().unwrap();
-                let regs = ["rdi", "rsi", "rdx", "rcx", "r8", "r9"];
                 let args = &l[2..];
                 for i in (6..args.len()).rev() {
                     self.lower_expr(&args[i]);
-                    self.emit("  push rax".to_string());
+                    self.emit("  push rax");
                 }
                 for arg in args.iter().take(6) {
                     self.lower_expr(arg);
-                    self.emit("  push rax".to_string());
+                    self.emit("  push rax");
                 }
                 for i in (0..std::cmp::min(args.len(), 6)).rev() {
-                    self.emit(format!("  pop {}", regs[i]));
+                    emit!(self, "  pop {}", X86_64_ARG_REGS[i]);
                 }
-                self.emit(format!("  call {}", name));
-                if args.len() > 6 { self.emit(format!("  add rsp, {}", (args.len() - 6) * 8)); }
+                self.makes_calls = true;
+                emit!(self, "  call {}", name);
+                if args.len() > 6 { emit!(self, "  add rsp, {}", (args.len() - 6) * 8); }
             }
             "string_typed" => {
                 let val = l[1].as_atom().unwrap();
-                let off = self.strings.get(val).unwrap();
-                self.emit(format!("  mov rax, {}", off));
+                let off = self.strings.offset(val);
+                emit!(self, "  mov rax, {}", off);
             }
-            "syscall" => self.emit("  syscall".to_string()),
+            "syscall" => self.emit("  syscall"),
             _ => {}
         }
     }
 }
 
-struct AArch64Backend {
-    ir: IRNode,
-    output: Vec<String>,
+struct AArch64Backend<'a> {
+    ir: IRNode<'a>,
+    output: String,
     vars: HashMap<String, (i32, String)>,
-    strings: HashMap<String, i32>,
-    structs: HashMap<String, Vec<String>>,
+    strings: StringTable,
+    structs: HashMap<String, HashMap<String, i32>>,
     label_count: i32,
     current_fn: String,
+    makes_calls: bool,
 }
 
-impl AArch64Backend {
-    fn new(ir: IRNode) -> Self {
+impl<'a> AArch64Backend<'a> {
+    fn new(ir: IRNode<'a>) -> Self {
         Self {
             ir,
-            output: Vec::new(),
+            output: String::new(),
             vars: HashMap::new(),
-            strings: HashMap::new(),
+            strings: StringTable::new(),
             structs: HashMap::new(),
             label_count: 0,
             current_fn: String::new(),
+            makes_calls: false,
         }
     }
 
-    fn emit(&mut self, s: String) { self.output.push(s); }
+    fn emit(&mut self, s: impl AsRef<str>) { self.output.push_str(s.as_ref()); self.output.push('\n'); }
+    fn emit_string_data(&mut self) {
+        if self.strings.len == 0 { return; }
+        self.emit(".section .rodata\n.L_str_data:");
+        self.output.push_str(&self.strings.rows);
+        self.emit(".text");
+    }
     fn new_label(&mut self, prefix: &str) -> String {
         self.label_count += 1;
         format!(".{}{}", prefix, self.label_count)
     }
 
-    fn collect_strings(&mut self, node: &IRNode) {
-        if let IRNode::List(l) = node {
-            if !l.is_empty() {
-                if let Some(atom) = l[0].as_atom() {
-                    if atom == "string_typed" && l.len() > 1 {
-                        if let Some(val) = l[1].as_atom() {
-                            self.strings.insert(val.clone(), 0);
-                        }
-                    }
-                }
-            }
-            for child in l { self.collect_strings(child); }
-        }
-    }
-
     fn safe_mov_imm(&mut self, reg: &str, val: i64) {
         if (0..65536).contains(&val) {
-            self.emit(format!("  mov {}, #{}", reg, val));
+            emit!(self, "  mov {}, #{}", reg, val);
         } else {
-            self.emit(format!("  movz {}, #{}", reg, val & 0xffff));
-            if (val >> 16) & 0xffff != 0 { self.emit(format!("  movk {}, #{}", reg, (val >> 16) & 0xffff) + ", lsl #16"); }
-            if (val >> 32) & 0xffff != 0 { self.emit(format!("  movk {}, #{}", reg, (val >> 32) & 0xffff) + ", lsl #32"); }
-            if (val >> 48) & 0xffff != 0 { self.emit(format!("  movk {}, #{}", reg, (val >> 48) & 0xffff) + ", lsl #48"); }
+            emit!(self, "  movz {}, #{}", reg, val & 0xffff);
+            for shift in [16, 32, 48] {
+                let part = (val >> shift) & 0xffff;
+                if part != 0 { emit!(self, "  movk {}, #{}, lsl #{}", reg, part, shift); }
+            }
         }
     }
 
     fn ldr_x29(&mut self, reg: &str, off: i32) {
-        if (-256..=4095).contains(&off) { self.emit(format!("  ldr {}, [x29, #{}]", reg, off)); }
-        else { self.safe_mov_imm("x1", off as i64); self.emit(format!("  ldr {}, [x29, x1]", reg)); }
+        if (-256..=4095).contains(&off) { emit!(self, "  ldr {}, [x29, #{}]", reg, off); }
+        else { self.safe_mov_imm("x1", off as i64); emit!(self, "  ldr {}, [x29, x1]", reg); }
     }
 
     fn ldrsw_x29(&mut self, reg: &str, off: i32) {
-        if (-256..=4095).contains(&off) { self.emit(format!("  ldrsw {}, [x29, #{}]", reg, off)); }
-        else { self.safe_mov_imm("x1", off as i64); self.emit(format!("  ldrsw {}, [x29, x1]", reg)); }
+        if (-256..=4095).contains(&off) { emit!(self, "  ldrsw {}, [x29, #{}]", reg, off); }
+        else { self.safe_mov_imm("x1", off as i64); emit!(self, "  ldrsw {}, [x29, x1]", reg); }
     }
 
     fn str_x29(&mut self, reg: &str, off: i32) {
-        if (-256..=4095).contains(&off) { self.emit(format!("  str {}, [x29, #{}]", reg, off)); }
-        else { self.safe_mov_imm("x1", off as i64); self.emit(format!("  str {}, [x29, x1]", reg)); }
+        if (-256..=4095).contains(&off) { emit!(self, "  str {}, [x29, #{}]", reg, off); }
+        else { self.safe_mov_imm("x1", off as i64); emit!(self, "  str {}, [x29, x1]", reg); }
     }
 
     fn lower(&mut self) {
-        let mut fns: Vec<IRNode> = Vec::new();
-        let mut structs_list: Vec<IRNode> = Vec::new();
-
-        if let IRNode::List(root) = &self.ir {
-            for child in root {
-                if let IRNode::List(c) = child {
-                    if !c.is_empty() {
-                        if c[0].as_atom().map(|s| s == "functions").unwrap_or(false) {
-                            fns = c[1..].to_vec();
-                        } else if c[0].as_atom().map(|s| s == "structs").unwrap_or(false) {
-                            structs_list = c[1..].to_vec();
-                        }
-                    }
-                }
-            }
-        }
-
-        for s in structs_list {
-            if let IRNode::List(sl) = s {
-                let name = sl[1].as_atom().unwrap().clone();
-                let fields = sl[2..].iter().map(|f| f.as_list().unwrap()[1].as_atom().unwrap().clone()).collect();
-                self.structs.insert(name, fields);
-            }
-        }
+        let ir = std::mem::replace(&mut self.ir, IRNode::List(Vec::new()));
+        let fns = scan_sections(&ir, &mut self.structs);
+        self.output.reserve(AARCH64_PRELUDE.len() + AARCH64_START.len() + AARCH64_START_TAIL.len() + INTRINSICS_AARCH64.len() + 4);
 
-        self.emit(".bss".to_string());
-        self.emit(".align 4".to_string());
-        self.emit(".globl __coatl_mem".to_string());
-        self.emit("__coatl_mem:".to_string());
-        self.emit("  .zero 1048576".to_string());
-        self.emit("__coatl_mem_inited:".to_string());
-        self.emit("  .word 0".to_string());
-        self.emit(".text".to_string());
-        self.emit("__coatl_init_memory:".to_string());
-        self.emit("  stp x29, x30, [sp, #-16]!".to_string());
-        self.emit("  mov x29, sp".to_string());
-        self.emit("  adrp x0, __coatl_mem_inited; ldr w1, [x0, :lo12:__coatl_mem_inited]; cbnz w1, .L_mem_done".to_string());
-        self.emit("  mov w1, #1; str w1, [x0, :lo12:__coatl_mem_inited]".to_string());
-        self.emit("  adrp x2, __coatl_mem; add x2, x2, :lo12:__coatl_mem".to_string());
+        self.emit(AARCH64_PRELUDE);
 
-        for func in &fns { self.collect_strings(func); }
+        for func in fns { self.lower_fn(func); }
 
-        let mut off: i32 = 65536;
-        let mut sorted_strings: Vec<_> = self.strings.keys().cloned().collect();
-        sorted_strings.sort();
-        for s in sorted_strings {
-            let bytes = s.as_bytes().to_vec();
-            for (i, &b) in bytes.iter().enumerate() {
-                self.safe_mov_imm("x1", (off + i as i32) as i64);
-                self.emit(format!("  mov w0, #{}; strb w0, [x2, x1]", b));
-            }
-            self.safe_mov_imm("x1", (off + bytes.len() as i32) as i64);
-            self.emit("  strb wzr, [x2, x1]".to_string());
-            self.strings.insert(s, off);
-            off += bytes.len() as i32 + 1;
+        self.emit(AARCH64_START);
+        if self.strings.len > 0 {
+            self.emit("  adrp x0, __coatl_mem; add x0, x0, :lo12:__coatl_mem");
+            self.safe_mov_imm("x2", STRINGS_BASE as i64);
+            self.emit("  add x0, x0, x2\n  adrp x1, .L_str_data; add x1, x1, :lo12:.L_str_data");
+            self.safe_mov_imm("x3", self.strings.len as i64);
+            self.emit(".L_str_copy:\n  ldrb w4, [x1], #1; strb w4, [x0], #1\n  subs x3, x3, #1; b.ne .L_str_copy");
         }
-
-        self.emit(".L_mem_done:".to_string());
-        self.emit("  ldp x29, x30, [sp], #16".to_string());
-        self.emit("  ret".to_string());
-
-        for func in fns { self.lower_fn(&func); }
-
-        self.emit(".globl coatl_start".to_string());
-        self.emit("coatl_start:".to_string());
-        self.emit("  stp x29, x30, [sp, #-16]!".to_string());
-        self.emit("  bl __coatl_init_memory".to_string());
-        self.emit("  bl main".to_string());
-        self.emit("  mov w0, w0; mov x8, #93; svc #0".to_string());
-        self.emit(INTRINSICS_AARCH64.to_string());
+        self.emit(AARCH64_START_TAIL);
+        self.emit_string_data();
+        self.emit(INTRINSICS_AARCH64);
+        self.ir = ir;
     }
 
     fn lower_fn(&mut self, n: &IRNode) {
         if let IRNode::List(l) = n {
             let name = l[1].as_atom().unwrap();
-            self.current_fn = name.clone();
+            self.current_fn = name.to_string();
             self.vars.clear();
-            self.emit(format!(".global {}\n{}:", name, name));
-            self.emit("  stp x29, x30, [sp, #-16]!; mov x29, sp; sub sp, sp, #4096".to_string());
+            self.makes_calls = false;
+            emit!(self, ".global {0}\n{0}:", name);
+            let frame_at = self.output.len();
             
             let mut o = 16;
             if let IRNode::List(params) = &l[2] {
@@ -987,8 +1126,8 @@ impl AArch64Backend {
                     if let IRNode::List(pl) = p {
                         let p_name = pl[1].as_atom().unwrap();
                         let p_type = pl[2].as_atom().unwrap();
-                        self.vars.insert(p_name.clone(), (o, p_type.clone()));
-                        if i < 8 { self.str_x29(&format!("x{}", i), -o); }
+                        self.vars.insert(p_name.to_string(), (o, p_type.to_string()));
+                        if i < 8 { self.str_x29(AARCH64_ARG_REGS[i], -o); }
                         else {
                             let stack_off = 16 + (i as i32 - 8) * 8;
                             self.ldr_x29("x0", stack_off);
@@ -1002,19 +1141,26 @@ impl AArch64Backend {
             if let IRNode::List(body) = &l[4] {
                 for stmt in &body[1..] { self.lower_stmt(stmt); }
             }
-            self.emit(format!(".Lret_{}:; add sp, sp, #4096; ldp x29, x30, [sp], #16; ret", name));
+            // Without calls x30 is never clobbered, so a leaf with no slots can skip the frame record.
+            if self.makes_calls || !self.vars.is_empty() {
+                let frame = frame_size(self.vars.values().map(|v| v.0).max().unwrap_or(0));
+                self.output.insert_str(frame_at, &format!("  stp x29, x30, [sp, #-16]!; mov x29, sp; sub sp, sp, #{}\n", frame));
+                emit!(self, ".Lret_{}:; add sp, sp, #{}; ldp x29, x30, [sp], #16; ret", name, frame);
+            } else {
+                emit!(self, ".Lret_{}:; ret", name);
+            }
         }
     }
 
     fn lower_stmt(&mut self, n: &IRNode) {
         let l = n.as_list().unwrap();
         let head = l[0].as_atom().unwrap();
-        match head.as_str() {
+        match head {
             "let" => {
                 let name = l[1].as_atom().unwrap();
                 let vtype = l[2].as_atom().unwrap();
                 let off = (self.vars.len() as i32 + 2) * 8;
-                self.vars.insert(name.clone(), (off, vtype.clone()));
+                self.vars.insert(name.to_string(), (off, vtype.to_string()));
                 self.lower_expr(&l[3]);
                 self.str_x29("x0", -off);
             }
@@ -1028,50 +1174,59 @@ impl AArch64Backend {
                 let l_else = self.new_label("else");
                 let l_end = self.new_label("endif");
                 self.lower_expr(&l[1]);
-                self.emit(format!("  cbz x0, {}", l_else));
+                emit!(self, "  cbz x0, {}", l_else);
                 self.lower_stmt(&l[2]);
-                self.emit(format!("  b {}", l_end));
-                self.emit(format!("{}:", l_else));
+                emit!(self, "  b {}\n{}:", l_end, l_else);
                 if l.len() > 3 { self.lower_stmt(&l[3].as_list().unwrap()[1]); }
-                self.emit(format!("{}:", l_end));
+                emit!(self, "{}:", l_end);
             }
             "while" => {
                 let l_start = self.new_label("while");
                 let l_end = self.new_label("endwhile");
-                self.emit(format!("{}:", l_start));
+                emit!(self, "{}:", l_start);
                 self.lower_expr(&l[1]);
-                self.emit(format!("  cbz x0, {}", l_end));
+                emit!(self, "  cbz x0, {}", l_end);
                 self.lower_stmt(&l[2]);
-                self.emit(format!("  b {}", l_start));
-                self.emit(format!("{}:", l_end));
+                emit!(self, "  b {}\n{}:", l_start, l_end);
             }
             "block" => { for s in &l[1..] { self.lower_stmt(s); } }
             "return" => {
                 self.lower_expr(&l[1]);
                 let label = format!(".Lret_{}", self.current_fn);
-                self.emit(format!("  b {}", label));
+                emit!(self, "  b {}", label);
             }
             "svc" => {
                 let args = &l[1..];
                 for arg in args {
                     self.lower_expr(arg);
-                    self.emit("  str x0, [sp, #-16]!".to_string());
+                    self.emit("  str x0, [sp, #-16]!");
                 }
-                if !args.is_empty() { self.emit("  ldr x8, [sp], #16".to_string()); }
-                if args.len() > 1 { self.emit("  ldr x0, [sp], #16".to_string()); }
-                if args.len() > 2 { self.emit("  ldr x1, [sp], #16".to_string()); }
-                if args.len() > 3 { self.emit("  ldr x2, [sp], #16".to_string()); }
-                self.emit("  svc #0".to_string());
+                if !args.is_empty() { self.emit("  ldr x8, [sp], #16"); }
+                if args.len() > 1 { self.emit("  ldr x0, [sp], #16"); }
+                if args.len() > 2 { self.emit("  ldr x1, [sp], #16"); }
+                if args.len() > 3 { self.emit("  ldr x2, [sp], #16"); }
+                self.emit("  svc #0");
             }
             "expr" => { self.lower_expr(&l[1]); }
             _ => {}
         }
     }
 
+    fn lower_operand_x1(&mut self, n: &IRNode) {
+        let l = n.as_list().unwrap();
+        if l[0].as_atom() == Some("ident") {
+            let off = self.vars.get(l[1].as_atom().unwrap()).unwrap().0;
+            self.ldrsw_x29("x1", -off);
+        } else {
+            let val: i64 = l[1].as_atom().unwrap().parse().unwrap();
+            self.safe_mov_imm("x1", val);
+        }
+    }
+
     fn lower_expr(&mut self, n: &IRNode) {
         let l = n.as_list().unwrap();
         let head = l[0].as_atom().unwrap();
-        match head.as_str() {
+        match head {
             "int" | "int_i64" | "bool" => {
                 let val: i64 = l[1].as_atom().unwrap().parse().unwrap();
                 self.safe_mov_imm("x0", val);
@@ -1082,20 +1237,27 @@ impl AArch64Backend {
                 self.ldrsw_x29("x0", -off);
             }
             "binary" => {
-                let op = l[1].as_atom().unwrap();
-                self.lower_expr(&l[2]); self.emit("  str x0, [sp, #-16]!".to_string());
-                self.lower_expr(&l[3]); self.emit("  mov x1, x0; ldr x0, [sp], #16".to_string());
-                match op.as_str() {
-                    "add" => self.emit("  add x0, x0, x1".to_string()),
-                    "sub" => self.emit("  sub x0, x0, x1".to_string()),
-                    "mul" => self.emit("  mul x0, x0, x1".to_string()),
-                    "div" => self.emit("  sdiv x0, x0, x1".to_string()),
-                    "and" => self.emit("  and x0, x0, x1".to_string()),
-                    "or" => self.emit("  orr x0, x0, x1".to_string()),
-                    _ => {
-                        let cond = match op.as_str() { "eq"=>"eq", "ne"=>"ne", "lt"=>"lt", "gt"=>"gt", "le"=>"le", "ge"=>"ge", _=>"eq" };
-                        self.emit(format!("  cmp x0, x1; cset w0, {}", cond));
-                    }
+                let (op, lhs, rhs) = binary_operands(l);
+                if is_simple_operand(rhs) {
+                    self.lower_expr(lhs);
+                    self.lower_operand_x1(rhs);
+                } else {
+                    self.lower_expr(lhs); self.emit("  str x0, [sp, #-16]!");
+                    self.lower_expr(rhs); self.emit("  mov x1, x0; ldr x0, [sp], #16");
+                }
+                match op {
+                    "add" => self.emit("  add x0, x0, x1"),
+                    "sub" => self.emit("  sub x0, x0, x1"),
+                    "mul" => self.emit("  mul x0, x0, x1"),
+                    "div" => self.emit("  sdiv x0, x0, x1"),
+                    "and" => self.emit("  and x0, x0, x1"),
+                    "or" => self.emit("  orr x0, x0, x1"),
+                    "ne" => self.emit("  cmp x0, x1; cset w0, ne"),
+                    "lt" => self.emit("  cmp x0, x1; cset w0, lt"),
+                    "gt" => self.emit("  cmp x0, x1; cset w0, gt"),
+                    "le" => self.emit("  cmp x0, x1; cset w0, le"),
+                    "ge" => self.emit("  cmp x0, x1; cset w0, ge"),
+                    _ => self.emit("  cmp x0, x1; cset w0, eq"),
                 }
             }
             "call" => {
@@ -1103,24 +1265,25 @@ impl AArch64Backend {
                 let args = &l[2..];
                 for i in (8..args.len()).rev() {
                     self.lower_expr(&args[i]);
-                    self.emit("  str x0, [sp, #-16]!".to_string());
+                    self.emit("  str x0, [sp, #-16]!");
                 }
                 for arg in args.iter().take(8) {
                     self.lower_expr(arg);
-                    self.emit("  str x0, [sp, #-16]!".to_string());
+                    self.emit("  str x0, [sp, #-16]!");
                 }
                 for i in (0..std::cmp::min(args.len(), 8)).rev() {
-                    self.emit(format!("  ldr x{}, [sp], #16", i));
+                    emit!(self, "  ldr {}, [sp], #16", AARCH64_ARG_REGS[i]);
                 }
-                self.emit(format!("  bl {}", name));
+                self.makes_calls = true;
+                emit!(self, "  bl {}", name);
                 if args.len() > 8 {
-                    self.emit(format!("  add sp, sp, #{}", (args.len() - 8) * 16));
+                    emit!(self, "  add sp, sp, #{}", (args.len() - 8) * 16);
                 }
             }
             "string_typed" => {
                 let val = l[1].as_atom().unwrap();
-                let off = self.strings.get(val).unwrap();
-                self.safe_mov_imm("x0", *off as i64);
+                let off = self.strings.offset(val);
+                self.safe_mov_imm("x0", off as i64);
             }
             "str_len" | "str_ptr" => self.lower_expr(&l[1]),
             _ => {}
@@ -1146,10 +1309,20 @@ fn main() {
         else { input_path = args[i].clone(); i += 1; }
     }
 
+    // Declared ahead of the tree so that atoms parsed from .ir input can borrow from it.
+    let ir_source: String;
     let ir = if input_path.ends_with(".ir") {
-        let source = fs::read_to_string(&input_path).expect("Failed to read input file");
-        let mut parser = IRParser::new(&source);
-        parser.parse().expect("Failed to parse IR")
+        ir_source = fs::read_to_string(&input_path).expect("Failed to read input file");
+        let mut parser = IRParser::new(&ir_source);
+        // Anything but a coatl_ir root would lower to a runtime with no functions; reject it before any emission.
+        match parser.parse() {
+            Some(ir) if ir.as_list().and_then(|l| l.first()).and_then(|h| h.as_atom()) == Some("coatl_ir") => ir,
+            Some(_) => {
+                eprintln!("IR root must be a (coatl_ir ...) list");
+                process::exit(1);
+            }
+            None => panic!("Failed to parse IR"),
+        }
     } else {
         let mut all_structs = Vec::new();
         let mut all_fns = Vec::new();
@@ -1157,41 +1330,39 @@ fn main() {
         let mut visited = HashSet::new();
         parse_file_recursive(PathBuf::from(&input_path), &mut visited, &mut all_structs, &mut all_fns, &mut all_imports);
         IRNode::List(vec![
-            IRNode::Atom("coatl_ir".to_string()),
-            IRNode::Atom("v1".to_string()),
-            IRNode::List(vec![IRNode::Atom("imports".to_string())]), // Simplification: imports already resolved
-            IRNode::List(vec![IRNode::Atom("structs".to_string())].into_iter().chain(all_structs).collect()),
-            IRNode::List(vec![IRNode::Atom("functions".to_string())].into_iter().chain(all_fns).collect()),
+            IRNode::Atom("coatl_ir".into()),
+            IRNode::Atom("v1".into()),
+            IRNode::List(vec![IRNode::Atom("imports".into())]), // Simplification: imports already resolved
+            IRNode::List(vec![IRNode::Atom("structs".into())].into_iter().chain(all_structs).collect()),
+            IRNode::List(vec![IRNode::Atom("functions".into())].into_iter().chain(all_fns).collect()),
         ])
     };
 
     if output_path.ends_with(".ir") {
-        fs::write(output_path, ir.to_ir()).expect("Failed to write IR output");
+        let mut out = io::BufWriter::new(fs::File::create(output_path).expect("Failed to write IR output"));
+        ir.write_ir(&mut out).and_then(|_| out.flush()).expect("Failed to write IR output");
         return;
     }
 
     let output = if arch == "aarch64" {
         let mut backend = AArch64Backend::new(ir);
         backend.lower();
-        backend.output.join("\n") + "\n"
+        backend.output
     } else {
         let mut backend = X86_64Backend::new(ir);
         backend.lower();
-        backend.output.join("\n") + "\n"
+        backend.output
     };
 
     if !output_path.is_empty() {
         if output_path.ends_with(".s") || output_path.ends_with(".ir") {
             fs::write(output_path, output).expect("Failed to write output");
         } else {
-            // Need to assemble and link
-            let mut tmp_s = env::temp_dir();
-            tmp_s.push("coatl_tmp.s");
-            fs::write(&tmp_s, output).expect("Failed to write temp assembly");
-            
+            // Need to assemble and link; the assembly is piped to the driver rather than staged in a temp file
+            let cc_args = ["-fPIE", "-pie", "-e", "coatl_start", "-x", "assembler", "-", "-o", &output_path];
             let cc = env::var("CC").unwrap_or_else(|_| "cc".to_string());
             let mut cmd = process::Command::new(&cc);
-            cmd.args(&["-fPIE", "-pie", "-e", "coatl_start", tmp_s.to_str().unwrap(), "-o", &output_path]);
+            cmd.args(&cc_args);
             
             // Special handling for aarch64 cross-compilation match
             if arch == "aarch64" {
@@ -1201,19 +1372,21 @@ fn main() {
                     let cross_cc = "aarch64-linux-gnu-gcc";
                     if process::Command::new("command").args(&["-v", cross_cc]).status().map(|s| s.success()).unwrap_or(false) {
                         cmd = process::Command::new(cross_cc);
-                        cmd.args(&["-fPIE", "-pie", "-e", "coatl_start", tmp_s.to_str().unwrap(), "-o", &output_path]);
+                        cmd.args(&cc_args);
                     }
                 }
             }
 
-            let status = cmd.status().expect("Failed to run linker");
-            if !status.success() {
+            let mut child = cmd.stdin(process::Stdio::piped()).spawn().expect("Failed to run linker");
+            // Closing stdin after the write tells the assembler the input is complete.
+            let written = child.stdin.take().unwrap().write_all(output.as_bytes());
+            let status = child.wait().expect("Failed to run linker");
+            if written.is_err() || !status.success() {
                 eprintln!("Linker failed");
                 process::exit(1);
             }
-            let _ = fs::remove_file(tmp_s);
         }
     } else {
-        print!("{}", output);
+        io::stdout().lock().write_all(output.as_bytes()).expect("Failed to write output");
     }
 }
@@ -35,6 +35,15 @@ fn build_bin(src: &str, bin_name: &str, arch: &str) -> Option<PathBuf> {
     }
 }
 
+// Writes `src` to a scratch .coatl file and builds it, for cases too small to warrant a file under tests/.
+fn build_src(src: &str, bin_name: &str, arch: &str) -> Option<PathBuf> {
+    let tmp_dir = env::temp_dir().join(format!("coatl-test-{}", bin_name));
+    let _ = fs::create_dir_all(&tmp_dir);
+    let src_path = tmp_dir.join(format!("{}.coatl", bin_name));
+    fs::write(&src_path, src).unwrap();
+    build_bin(src_path.to_str().unwrap(), bin_name, arch)
+}
+
 fn assert_rc(expected: i32, got: i32, label: &str) {
     assert_eq!(expected, got, "[FAIL] {} expected rc={} got rc={}", label, expected, got);
 }
@@ -85,6 +94,155 @@ fn test_ir_smoke() {
     assert!(content.contains("(fn print"));
 }
 
+#[test]
+fn test_ir_rejects_foreign_root() {
+    let tmp_dir = env::temp_dir().join("coatl-ir-root");
+    let _ = fs::create_dir_all(&tmp_dir);
+
+    // Well-formed IR whose root is not coatl_ir is reported separately from a syntax error.
+    let ir = tmp_dir.join("foo.ir");
+    fs::write(&ir, "(foo)").unwrap();
+    let output = Command::new(get_coatl_bin())
+        .arg(&ir)
+        .arg("-o")
+        .arg(tmp_dir.join("foo.s"))
+        .output().unwrap();
+    assert!(!output.status.success());
+    let stderr = String::from_utf8_lossy(&output.stderr);
+    assert!(stderr.contains("IR root must be a (coatl_ir ...) list"), "[FAIL] unexpected stderr: {}", stderr);
+}
+
+#[test]
+fn test_hex_literal_suffix() {
+    let root_dir = env::current_dir().unwrap();
+    let tmp_dir = env::temp_dir().join("coatl-hex-suffix");
+    let _ = fs::create_dir_all(&tmp_dir);
+
+    // Hex digits take precedence over a trailing f32 suffix: 0x1f32 is an int.
+    let ir = tmp_dir.join("hex_suffix_literal.ir");
+    let status = Command::new(get_coatl_bin())
+        .arg(root_dir.join("tests/hex_suffix_literal.coatl").to_str().unwrap())
+        .arg("-o")
+        .arg(&ir)
+        .status().unwrap();
+    assert!(status.success());
+    let content = fs::read_to_string(&ir).unwrap();
+    assert!(content.contains("(int 0x1f32)"), "[FAIL] hex literal lexed as {}", content);
+    assert!(!content.contains("(f32"));
+}
+
+#[test]
+fn test_x86_binary_operand_order() {
+    if env::consts::OS != "linux" || env::consts::ARCH != "x86_64" {
+        println!("Skipping x86_64 execution tests (not linux/x86_64)");
+        return;
+    }
+
+    // A literal on the left and a call on the right makes the backend swap the operands,
+    // mirroring comparisons; each case checks the result against the unswapped meaning.
+    let cases = vec![
+        ("1 < three()", "op-lt", 1),
+        ("3 < three()", "op-lt-equal", 0),
+        ("4 < three()", "op-lt-false", 0),
+        ("1 > three()", "op-gt", 0),
+        ("3 > three()", "op-gt-equal", 0),
+        ("4 > three()", "op-gt-true", 1),
+        ("1 <= three()", "op-le", 1),
+        ("3 <= three()", "op-le-equal", 1),
+        ("1 >= three()", "op-ge", 0),
+        ("3 >= three()", "op-ge-equal", 1),
+        ("1 - three()", "op-sub", 254),
+    ];
+
+    for (expr, bin_name, expected_rc) in cases {
+        let src = format!("fn three() returns i32 {{\n  return 3\n}}\n\nfn main() returns i32 {{\n  return {}\n}}\n", expr);
+        let bin_path = build_src(&src, bin_name, "x86_64").expect("Build failed");
+        let status = Command::new(&bin_path).status().unwrap();
+        assert_rc(expected_rc, status.code().unwrap_or(-1), expr);
+    }
+}
+
+#[test]
+fn test_x86_large_frame() {
+    if env::consts::OS != "linux" || env::consts::ARCH != "x86_64" {
+        println!("Skipping x86_64 execution tests (not linux/x86_64)");
+        return;
+    }
+
+    // 600 locals need more than 512 8-byte slots, pushing the frame past the 4096-byte rounding step.
+    let mut src = String::from("fn main() returns i32 {\n");
+    for i in 0..600 {
+        src.push_str(&format!("  let v{}: i32 = {}\n", i, i));
+    }
+    src.push_str("  return v599 - v550 + v0 + v1\n}\n");
+    let bin_path = build_src(&src, "large-frame", "x86_64").expect("Build failed");
+    let status = Command::new(&bin_path).status().unwrap();
+    assert_rc(50, status.code().unwrap_or(-1), "large-frame");
+}
+
+// Lines of function `name` in an assembly listing, from its label up to its first `ret`.
+fn fn_body<'a>(asm: &'a str, name: &str) -> Vec<&'a str> {
+    let label = format!("{}:", name);
+    let mut lines = asm.lines().skip_while(|l| *l != label);
+    let mut body = Vec::new();
+    while let Some(line) = lines.next() {
+        body.push(line);
+        if line.trim_end().ends_with("ret") { break; }
+    }
+    assert!(!body.is_empty(), "[FAIL] no {} in assembly", label);
+    body
+}
+
+#[test]
+fn test_leaf_fn_frameless() {
+    let src = "fn f() returns i32 {\n  return 7\n}\n\nfn main() returns i32 {\n  return f()\n}\n";
+    let tmp_dir = env::temp_dir().join("coatl-leaf-fn");
+    let _ = fs::create_dir_all(&tmp_dir);
+    let src_path = tmp_dir.join("leaf.coatl");
+    fs::write(&src_path, src).unwrap();
+
+    // A function with no calls and no locals gets no frame on either backend.
+    for (arch, frame_insns) in [("x86_64", ["push rbp", "leave"]), ("aarch64", ["stp x29, x30", "ldp x29, x30"])] {
+        let asm_path = tmp_dir.join(format!("leaf-{}.s", arch));
+        let status = Command::new(get_coatl_bin())
+            .arg(&src_path)
+            .arg(format!("--arch={}", arch))
+            .arg("-o")
+            .arg(&asm_path)
+            .status().unwrap();
+        assert!(status.success());
+        let asm = fs::read_to_string(&asm_path).unwrap();
+        for line in fn_body(&asm, "f") {
+            for insn in frame_insns {
+                assert!(!line.contains(insn), "[FAIL] {} leaf f has a frame: {}", arch, line);
+            }
+        }
+    }
+
+    if env::consts::OS == "linux" && env::consts::ARCH == "x86_64" {
+        let bin_path = build_bin(src_path.to_str().unwrap(), "leaf", "x86_64").expect("Build failed");
+        let status = Command::new(&bin_path).status().unwrap();
+        assert_rc(7, status.code().unwrap_or(-1), "leaf");
+    }
+}
+
+#[test]
+fn test_x86_string_literals() {
+    if env::consts::OS != "linux" || env::consts::ARCH != "x86_64" {
+        println!("Skipping x86_64 execution tests (not linux/x86_64)");
+        return;
+    }
+
+    // Literals are copied into the memory arena by coatl_start; both must reach stdout intact.
+    let root_dir = env::current_dir().unwrap();
+    let bin_path = build_bin(root_dir.join("tests/string_literals.coatl").to_str().unwrap(), "strings", "x86_64").expect("Build failed");
+    let output = Command::new(&bin_path).output().unwrap();
+    assert_rc(0, output.status.code().unwrap_or(-1), "strings");
+    let stdout = String::from_utf8_lossy(&output.stdout);
+    assert!(stdout.contains("first literal\n"), "[FAIL] missing first literal: {}", stdout);
+    assert!(stdout.contains("second literal\n"), "[FAIL] missing second literal: {}", stdout);
+}
+
 #[test]
 #[ignore]
 fn test_x86_subset_asm_smoke() {